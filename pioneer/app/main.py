@@ -4,17 +4,37 @@ import uvicorn
 from fastapi import FastAPI, HTTPException
 from fastapi.responses import JSONResponse
 
+# ORJSONResponse serializa las respuestas con orjson (núcleo en Rust); si
+# orjson no está instalado se mantiene el JSONResponse de la stdlib
+try:
+    import orjson  # noqa: F401
+    from fastapi.responses import ORJSONResponse as _DefaultResponseClass
+except ImportError:
+    _DefaultResponseClass = JSONResponse
+
 # Importar desde la carpeta models que ahora tiene los modelos en __init__.py
 from .models import StepRequest, StepResponse
 from .step_registry import get as get_handler
 
 # Al importar, todos los handlers se registran automáticamente
 from . import steps_realistic  # noqa: F401
+from .step_registry import freeze as freeze_step_registry
+
+# Con todos los steps registrados, congelar la tabla de despacho
+freeze_step_registry()
 
 logger = logging.getLogger("pioneer")
 logger.setLevel(logging.INFO)
 
-app = FastAPI(title="Pioneer - Workflow Steps Service")
+app = FastAPI(
+    title="Pioneer - Workflow Steps Service",
+    default_response_class=_DefaultResponseClass,
+)
+
+@app.on_event("shutdown")
+async def shutdown_http_clients():
+    """Cierra los clientes httpx compartidos hacia Discovery."""
+    await steps_realistic.close_discovery_clients()
 
 @app.get("/")
 async def health_check():
@@ -30,9 +50,9 @@ async def health_check_name():
 @app.get("/pioneer/steps")
 async def list_available_steps():
     """Lista todos los steps disponibles en Pioneer."""
-    from .step_registry import get_all_handlers
+    from .step_registry import get_all_handlers_view
     
-    handlers = get_all_handlers()
+    handlers = get_all_handlers_view()
     steps_info = []
     
     for step_name, handler_func in handlers.items():
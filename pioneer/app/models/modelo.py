@@ -6,7 +6,7 @@ class OcrConfigModelo(Base):
     __tablename__ = 'ocr_config_modelo'
 
     id = Column(Integer, primary_key=True, index=True)
-    nombre = Column(String(255), nullable = True)
+    nombre = Column(String(255), nullable=True, index=True)
     nombre_modelo = Column(String(255), nullable=False)
     descripcion = Column(Text, nullable=True)
     temperature = Column(Float, nullable=True)
@@ -48,15 +48,21 @@ class OcrConfigModelo(Base):
         CheckConstraint('max_output_tokens > 0', name='check_max_output_tokens'),
     )
 
+    # lazy="raise": ningún consumidor del hot path usa estas relaciones; un
+    # lazy-load implícito bajo AsyncSession fallaría de todos modos, mejor
+    # que truene en desarrollo. Cargar explícitamente con selectinload donde
+    # sí se necesiten.
     empresas = relationship(
         "OcrConfigEmpresa",
         secondary="ocr_config_modelo_empresa",
-        back_populates="modelos"
+        back_populates="modelos",
+        lazy="raise"
     )
     proyectos = relationship(
         "OcrConfigProyecto",
         secondary="ocr_config_modelo_proyecto",
-        back_populates="modelos"
+        back_populates="modelos",
+        lazy="raise"
     )
 
 # OcrConfigUsuario fue removido para evitar conflictos de mapeo
@@ -1,12 +1,36 @@
+import time
+from types import SimpleNamespace
+
 from sqlalchemy.future import select
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import raiseload
 from app.models.modelo import OcrConfigModelo
 from app.core2.database import AsyncSessionLocal
 
 
+# Cache con TTL para configuraciones de modelo: cambian rara vez y cada
+# petición del hot path pagaba un round-trip a la BD para releerlas
+_MODELO_CACHE_TTL = 300  # segundos
+_modelo_cache = {}  # nombre -> (expira_en, modelo)
+
+
+def invalidar_cache_modelos(nombre_modelo: str = None) -> None:
+    """
+    Invalida el cache de modelos (todo, o sólo la entrada indicada).
+
+    Llamar desde los endpoints que crean o actualizan modelos.
+    """
+    if nombre_modelo is None:
+        _modelo_cache.clear()
+    else:
+        _modelo_cache.pop(nombre_modelo, None)
+
+
 async def obtener_modelo_por_nombre(nombre_modelo: str) -> OcrConfigModelo:
     """
     Obtiene un modelo de configuración desde la base de datos por nombre.
+
+    Los resultados se cachean en memoria durante _MODELO_CACHE_TTL segundos.
     
     Args:
         nombre_modelo: Nombre del modelo a buscar
@@ -17,15 +41,26 @@ async def obtener_modelo_por_nombre(nombre_modelo: str) -> OcrConfigModelo:
     Raises:
         ValueError: Si no se encuentra el modelo
     """
+    ahora = time.monotonic()
+    cacheado = _modelo_cache.get(nombre_modelo)
+    if cacheado is not None and cacheado[0] > ahora:
+        return cacheado[1]
+
     async with AsyncSessionLocal() as db:
         try:
-            stmt = select(OcrConfigModelo).where(OcrConfigModelo.nombre == nombre_modelo)
+            # raiseload("*"): sólo se usan columnas del modelo, nunca relaciones
+            stmt = (
+                select(OcrConfigModelo)
+                .where(OcrConfigModelo.nombre == nombre_modelo)
+                .options(raiseload("*"))
+            )
             result = await db.execute(stmt)
             modelo = result.scalars().first()
             
             if not modelo:
                 raise ValueError(f"No se encontró el modelo con nombre: {nombre_modelo}")
-                
+
+            _modelo_cache[nombre_modelo] = (ahora + _MODELO_CACHE_TTL, modelo)
             return modelo
             
         except Exception as e:
@@ -58,29 +93,31 @@ async def obtener_modelo_por_id(modelo_id: int) -> OcrConfigModelo:
             raise ValueError(f"Error al obtener modelo desde la base de datos: {str(e)}")
 
 
+# Prototipo inmutable construido una sola vez al importar el módulo; los
+# consumidores sólo leen sus atributos
+_MODELO_POR_DEFECTO = SimpleNamespace(
+    id=0,
+    nombre="modelo_por_defecto",
+    nombre_modelo="gemini-2.5-flash",
+    descripcion="Extrae información de documentos y responde en formato JSON",
+    temperature=0.1,
+    top_p=0.8,
+    top_k=40,
+    max_output_tokens=8192,
+    notes="Analiza el documento y extrae toda la información relevante en formato JSON estructurado.",
+    block_harm_category_harassment="MEDIUM",
+    block_harm_category_hate_speech="MEDIUM",
+    block_harm_category_sexually_explicit="MEDIUM",
+    block_harm_category_dangerous_content="MEDIUM",
+    block_harm_category_civic_integrity="MEDIUM",
+)
+
+
 def crear_modelo_por_defecto() -> OcrConfigModelo:
     """
-    Crea un modelo de configuración por defecto para casos donde no se encuentra en la BD.
+    Devuelve el modelo de configuración por defecto para casos donde no se encuentra en la BD.
     
     Returns:
         OcrConfigModelo: Instancia del modelo por defecto
     """
-    from types import SimpleNamespace
-    
-    modelo = SimpleNamespace()
-    modelo.id = 0
-    modelo.nombre = "modelo_por_defecto"
-    modelo.nombre_modelo = "gemini-2.5-flash"
-    modelo.descripcion = "Extrae información de documentos y responde en formato JSON"
-    modelo.temperature = 0.1
-    modelo.top_p = 0.8
-    modelo.top_k = 40
-    modelo.max_output_tokens = 8192
-    modelo.notes = "Analiza el documento y extrae toda la información relevante en formato JSON estructurado."
-    modelo.block_harm_category_harassment = "MEDIUM"
-    modelo.block_harm_category_hate_speech = "MEDIUM"
-    modelo.block_harm_category_sexually_explicit = "MEDIUM"
-    modelo.block_harm_category_dangerous_content = "MEDIUM"
-    modelo.block_harm_category_civic_integrity = "MEDIUM"
-    
-    return modelo
+    return _MODELO_POR_DEFECTO
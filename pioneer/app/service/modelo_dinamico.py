@@ -1,6 +1,8 @@
 from datetime import datetime
+import logging
 import re
 import base64
+import httpx
 import requests
 import xml.etree.ElementTree as ET
 import asyncio
@@ -12,6 +14,7 @@ from pydantic import BaseModel
 from sqlalchemy import insert
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
+from sqlalchemy.orm import raiseload
 from io import BytesIO
 from functools import wraps
 
@@ -20,8 +23,87 @@ from models.modelo import OcrConfigModelo
 
 from utils.genai_extraccion import validar_hechos_con_modelo, limpiar_y_convertir_json
 from utils.carga_archivos_bucket.carga_archivos_bucket import gcs_manager
+from app.core2.database import AsyncSessionLocal
 from vertexai.generative_models import Part
 
+logger = logging.getLogger(__name__)
+
+# orjson parsea JSON en C; si no está instalado se usa sólo la ruta de
+# reparación con regex
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# lxml (libxml2) valida en modo streaming sin construir el árbol completo;
+# si no está instalado se usa xml.etree como fallback
+try:
+    from lxml import etree as LET
+    _XML_PARSE_ERRORS = (ET.ParseError, LET.XMLSyntaxError)
+except ImportError:
+    LET = None
+    _XML_PARSE_ERRORS = (ET.ParseError,)
+
+# Patrones compilados una sola vez a nivel de módulo (se usan en cada petición)
+_URL_RE = re.compile(r'^https?://')
+_TRAILING_COMMA_RE = re.compile(r',(\s*})')
+_JSON_PREFIX_RE = re.compile(r'^\s*json\s*\n')
+
+
+# Conjuntos de mimetypes aceptados, construidos una sola vez (probe O(1) en
+# lugar de recrear la lista en cada iteración del loop de documentos)
+_IMAGE_MIMES = frozenset({"image/jpeg", "image/png", "image/webp"})
+_AUDIO_MIMES = frozenset({"audio/mpeg", "audio/mp3", "audio/wav"})
+_VIDEO_MIMES = frozenset({
+    "video/mov", "video/mpeg", "video/mp4", "video/mpg",
+    "video/avi", "video/wmv", "video/mpegps", "video/flv",
+})
+_MULTIMEDIA_MIMES = frozenset(
+    {"application/pdf", "text/plain"} | _IMAGE_MIMES | _AUDIO_MIMES | _VIDEO_MIMES
+)
+
+# Límite de llamadas concurrentes a Vertex AI por worker; evita que un solo
+# endpoint monopolice la cuota del proyecto
+_LLM_MAX_CONCURRENT = 8
+_llm_semaphore = asyncio.Semaphore(_LLM_MAX_CONCURRENT)
+
+# --- Buffer de consumo de tokens --------------------------------------------
+# Las filas de consumo se acumulan en una cola y un task en segundo plano las
+# inserta por lotes, amortizando commits y round-trips bajo carga alta.
+_CONSUMO_FLUSH_INTERVAL = 0.5  # segundos
+_CONSUMO_FLUSH_MAX_ROWS = 500
+
+_consumo_queue: asyncio.Queue = asyncio.Queue()
+_consumo_flusher_task = None
+
+
+async def _flush_consumo_tokens():
+    """Drena la cola de consumo e inserta las filas en lotes."""
+    while True:
+        filas = [await _consumo_queue.get()]
+        try:
+            await asyncio.sleep(_CONSUMO_FLUSH_INTERVAL)
+            while len(filas) < _CONSUMO_FLUSH_MAX_ROWS:
+                try:
+                    filas.append(_consumo_queue.get_nowait())
+                except asyncio.QueueEmpty:
+                    break
+            async with AsyncSessionLocal() as db, db.begin():
+                await db.execute(insert(OCRConfigConsumoTokens), filas)
+        except Exception as e:
+            logger.warning("[CONSUMO_TOKENS] Error insertando lote de consumo: %s", e)
+        finally:
+            for _ in filas:
+                _consumo_queue.task_done()
+
+
+def _encolar_consumo(fila: dict):
+    """Encola una fila de consumo y arranca el flusher si no está corriendo."""
+    global _consumo_flusher_task
+    if _consumo_flusher_task is None or _consumo_flusher_task.done():
+        _consumo_flusher_task = asyncio.get_running_loop().create_task(_flush_consumo_tokens())
+    _consumo_queue.put_nowait(fila)
+
 
 def validar_archivo_multimedia(entrada, mimetype_esperado):
     """Valida si el archivo es un PDF, imagen, audio, video o texto."""
@@ -35,7 +117,7 @@ def validar_archivo_multimedia(entrada, mimetype_esperado):
                 detail="En uno de los documentos se esperaba un PDF, pero el contenido no es un PDF válido."
             )
 
-    elif mimetype_esperado in ["image/jpeg", "image/png", "image/webp"]:
+    elif mimetype_esperado in _IMAGE_MIMES:
         try:
             img = Image.open(BytesIO(entrada))
             if mimetype_esperado == "image/jpeg" and img.format.lower() not in ["jpeg", "jpg"]:
@@ -61,7 +143,7 @@ def validar_archivo_multimedia(entrada, mimetype_esperado):
                 detail=f"En uno de los documentos se esperaba una imagen {mimetype_esperado}, pero el contenido no es válido."
             )
 
-    elif mimetype_esperado in ["audio/mpeg", "audio/mp3", "audio/wav"]:
+    elif mimetype_esperado in _AUDIO_MIMES:
         # Validación básica para archivos de audio usando headers
         try:
             if mimetype_esperado in ["audio/mpeg", "audio/mp3"]:
@@ -86,7 +168,7 @@ def validar_archivo_multimedia(entrada, mimetype_esperado):
                 detail=f"En uno de los documentos se esperaba un archivo de audio {mimetype_esperado}, pero el contenido no es válido."
             )
 
-    elif mimetype_esperado in ["video/mov", "video/mpeg", "video/mp4", "video/mpg", "video/avi", "video/wmv", "video/mpegps", "video/flv"]:
+    elif mimetype_esperado in _VIDEO_MIMES:
         # Validación básica para archivos de video usando headers
         try:
             if mimetype_esperado == "video/mp4":
@@ -144,8 +226,14 @@ def validar_xml(entrada):
     """Valida si el archivo es un XML."""
 
     try:
-        ET.fromstring(entrada)  # Si no es XML válido, lanzará un error
-    except ET.ParseError:
+        if LET is not None:
+            # Sólo verificación de well-formedness: sin resolver entidades ni red
+            parser = LET.XMLParser(resolve_entities=False, huge_tree=False, no_network=True)
+            parser.feed(entrada)
+            parser.close()
+        else:
+            ET.fromstring(entrada)  # Si no es XML válido, lanzará un error
+    except _XML_PARSE_ERRORS:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="En uno de los documentos se esperaba un XML, pero el contenido no es un XML válido."
@@ -155,7 +243,7 @@ def validar_xml(entrada):
 
 def obtener_contenido(url: str, mimetype_esperado: str) -> bool:
     """Descarga el archivo desde una URL"""
-    if not re.match(r'^https?://', url):  # Validar si realmente es una URL
+    if not _URL_RE.match(url):  # Validar si realmente es una URL
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="En uno de los documentos la URL proporcionada no es válida."
@@ -172,13 +260,7 @@ def obtener_contenido(url: str, mimetype_esperado: str) -> bool:
                     detail="En uno de los documentos se esperaba un PDF, pero el contenido no es un PDF válido."
                 )
         elif mimetype_esperado == "application/xml":
-            try:
-                ET.fromstring(response.content)  # Si no es un XML válido, lanzará un error
-            except ET.ParseError:
-                raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="En uno de los documentos se esperaba un XML, pero el contenido no es un XML válido."
-            )
+            validar_xml(response.content)  # Si no es un XML válido, lanzará un error
         elif mimetype_esperado in ["image/png", "image/jpeg"]:
             try:
                 img = Image.open(BytesIO(response.content))  # Si no es una imagen válida, lanzará un error
@@ -198,8 +280,7 @@ def obtener_contenido(url: str, mimetype_esperado: str) -> bool:
             status_code=status.HTTP_400_BAD_REQUEST, 
             detail="No se puede acceder a uno de los documentos desde la URL proporcionada."
         )
-        
-import re
+
 
 def limpiar_json(cadena):
     """
@@ -213,10 +294,40 @@ def limpiar_json(cadena):
         str: El string JSON corregido.
     """
     # Reemplaza la coma que aparece antes de un cierre de llave, ignorando espacios en blanco.
-    cadena_limpia = re.sub(r',(\s*})', r'\1', cadena)
+    cadena_limpia = _TRAILING_COMMA_RE.sub(r'\1', cadena)
     return cadena_limpia
 
 
+async def _descargar_xmls(urls):
+    """Descarga y valida en paralelo los XML referenciados por URL.
+
+    Hace un solo GET por URL única y reutiliza los bytes tanto para la
+    validación como para construir el Part, en lugar de dos GETs
+    secuenciales por documento.
+    """
+    contenido_por_url = {}
+
+    async with httpx.AsyncClient(timeout=30) as client:
+        async def _fetch(url):
+            if not _URL_RE.match(url):  # Validar si realmente es una URL
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="En uno de los documentos la URL proporcionada no es válida."
+                )
+            response = await client.get(url)
+            if response.status_code != 200:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="No se puede acceder a uno de los documentos desde la URL proporcionada."
+                )
+            await asyncio.to_thread(validar_xml, response.content)
+            contenido_por_url[url] = response.content
+
+        await asyncio.gather(*(_fetch(url) for url in urls))
+
+    return contenido_por_url
+
+
 async def modelo_dinamico_v6(
     body: dict,
     #Estos no los vamos a utiliozar de momento
@@ -232,11 +343,21 @@ async def modelo_dinamico_v6(
                 detail="No se proporcionó archivos a procesar"
             )
         
-        listaDocumentos = ""
+        # Descargar y validar en paralelo los XML referenciados por URL antes
+        # de entrar al loop de documentos
+        xml_urls = {
+            documento['url'] for documento in data
+            if documento.get("mimetype") == "application/xml" and 'url' in documento
+        }
+        xml_por_url = await _descargar_xmls(xml_urls) if xml_urls else {}
+
+        # Acumular los nombres en una lista y unirlos al final (evita copiar
+        # el string completo en cada iteración)
+        nombresDocumentos = []
         listadoImagenes = []
         uploaded_uris = []  # Lista para trackear archivos subidos para limpieza
         
-        for documento in data:
+        for idx, documento in enumerate(data):
             if 'nombre' in documento:
                 field_documento = 'nombre'
             elif 'tipoDocumento' in documento:
@@ -248,11 +369,11 @@ async def modelo_dinamico_v6(
                 )
             
             # Manejo de archivos multimedia
-            if documento["mimetype"] in ["application/pdf", "audio/mpeg", "audio/mp3", "audio/wav", "image/png", "image/jpeg", "image/webp", "text/plain", "video/mov", "video/mpeg", "video/mp4", "video/mpg", "video/avi", "video/wmv", "video/mpegps", "video/flv"]:
+            if documento["mimetype"] in _MULTIMEDIA_MIMES:
                 if 'url' in documento:
                     # Para URLs, mantener el comportamiento original
-                    listaDocumentos += f"{documento[field_documento]}\n"
-                    image_variable_name = f"imagen_{data.index(documento) + 1}"
+                    nombresDocumentos.append(f"{documento[field_documento]}\n")
+                    image_variable_name = f"imagen_{idx + 1}"
                     locals()[image_variable_name] = Part.from_uri(
                         documento['url'],
                         mime_type=documento['mimetype']
@@ -261,16 +382,18 @@ async def modelo_dinamico_v6(
                 elif 'base64' in documento:
                     # Para base64, subir primero al bucket GCS con auto-eliminación
                     file_decode = base64.b64decode(documento['base64'])
-                    # Validar el contenido de un base64 con su mimetype
-                    validar_archivo_multimedia(file_decode, documento['mimetype'])
-                    listaDocumentos += f"{documento[field_documento]}\n"
+                    # Validar el contenido de un base64 con su mimetype sin
+                    # bloquear el event loop (PdfReader/PIL son CPU-bound)
+                    await asyncio.to_thread(validar_archivo_multimedia, file_decode, documento['mimetype'])
+                    nombresDocumentos.append(f"{documento[field_documento]}\n")
                     
-                    # Subir archivo al bucket con auto-eliminación en 5 minutos (300 segundos)
-                    upload_result = gcs_manager.upload_file_base64_with_auto_delete(
-                        base64_content=documento['base64'],
+                    # Subir archivo al bucket con auto-eliminación en 5 minutos (300 segundos);
+                    # se reutilizan los bytes ya decodificados para la validación
+                    upload_result = gcs_manager.upload_bytes_with_auto_delete(
+                        data=file_decode,
                         mime_type=documento['mimetype'],
-                        nombre_archivo=documento.get('nombre', f"archivo_{data.index(documento) + 1}"),
-                        label=f"temp_v6_{data.index(documento) + 1}",
+                        nombre_archivo=documento.get('nombre', f"archivo_{idx + 1}"),
+                        label=f"temp_v6_{idx + 1}",
                         auto_delete=300  # 5 minutos
                     )
                     
@@ -278,7 +401,7 @@ async def modelo_dinamico_v6(
                     bucket_uri = upload_result['uri']
                     uploaded_uris.append(bucket_uri)
                     
-                    image_variable_name = f"imagen_{data.index(documento) + 1}"
+                    image_variable_name = f"imagen_{idx + 1}"
                     locals()[image_variable_name] = Part.from_uri(
                         bucket_uri,
                         mime_type=documento['mimetype']
@@ -288,12 +411,10 @@ async def modelo_dinamico_v6(
             # Manejo de archivos XML
             elif documento["mimetype"] == "application/xml":
                 if 'url' in documento:
-                    # Para URLs XML, mantener el comportamiento original
-                    obtener_contenido(documento['url'], documento['mimetype'])
-                    listaDocumentos += f"{documento[field_documento]}\n"
-                    image_variable_name = f"imagen_{data.index(documento) + 1}"
-                    response = requests.get(documento['url'])
-                    xml_content = response.content
+                    # Contenido ya descargado y validado en paralelo
+                    nombresDocumentos.append(f"{documento[field_documento]}\n")
+                    image_variable_name = f"imagen_{idx + 1}"
+                    xml_content = xml_por_url[documento['url']]
                     locals()[image_variable_name] = Part.from_data(
                         xml_content,
                         mime_type="text/plain"
@@ -302,16 +423,16 @@ async def modelo_dinamico_v6(
                 elif 'base64' in documento:
                     # Para base64 XML, subir primero al bucket GCS
                     xml_content = base64.b64decode(documento['base64'])
-                    # Validar si el contenido es un xml valido
-                    validar_xml(xml_content)
-                    listaDocumentos += f"{documento[field_documento]}\n"
+                    # Validar si el contenido es un xml valido sin bloquear el event loop
+                    await asyncio.to_thread(validar_xml, xml_content)
+                    nombresDocumentos.append(f"{documento[field_documento]}\n")
                     
                     # Subir archivo XML al bucket con auto-eliminación en 5 minutos
-                    upload_result = gcs_manager.upload_file_base64_with_auto_delete(
-                        base64_content=documento['base64'],
+                    upload_result = gcs_manager.upload_bytes_with_auto_delete(
+                        data=xml_content,
                         mime_type="text/plain",  # Los XML se procesan como text/plain
-                        nombre_archivo=documento.get('nombre', f"xml_archivo_{data.index(documento) + 1}.xml"),
-                        label=f"temp_xml_v6_{data.index(documento) + 1}",
+                        nombre_archivo=documento.get('nombre', f"xml_archivo_{idx + 1}.xml"),
+                        label=f"temp_xml_v6_{idx + 1}",
                         auto_delete=300  # 5 minutos
                     )
                     
@@ -319,7 +440,7 @@ async def modelo_dinamico_v6(
                     bucket_uri = upload_result['uri']
                     uploaded_uris.append(bucket_uri)
                     
-                    image_variable_name = f"imagen_{data.index(documento) + 1}"
+                    image_variable_name = f"imagen_{idx + 1}"
                     locals()[image_variable_name] = Part.from_uri(
                         bucket_uri,
                         mime_type="text/plain"
@@ -331,10 +452,18 @@ async def modelo_dinamico_v6(
                     detail="El campo 'mimetype' debe ser 'application/pdf', 'image/png', 'image/jpeg' o 'application/xml'"
                 )
         
-        # Recupera el modelo de la base de datos
-        stmt = select(OcrConfigModelo).where(OcrConfigModelo.nombre == body.get("modelo"))
-        result = await db.execute(stmt)
-        ocr_config_modelo = result.scalars().first()
+        listaDocumentos = "".join(nombresDocumentos)
+
+        # Recupera el modelo de la base de datos en una sesión corta; la
+        # conexión se libera antes de la llamada (larga) al modelo generativo
+        stmt = (
+            select(OcrConfigModelo)
+            .where(OcrConfigModelo.nombre == body.get("modelo"))
+            .options(raiseload("*"))
+        )
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(stmt)
+            ocr_config_modelo = result.scalars().first()
         
         # Si no recupera el modelo manda un error
         if ocr_config_modelo is None:
@@ -344,9 +473,14 @@ async def modelo_dinamico_v6(
             )
         
         try:
-            # Obtener la respuesta y consumo del modelo
-            wraper = generar_texto_imagen_con_modelo_part(listaDocumentos, listadoImagenes, ocr_config_modelo)
-        
+            # Obtener la respuesta y consumo del modelo sin bloquear el event
+            # loop durante la espera (de segundos) de Vertex AI
+            async with _llm_semaphore:
+                wraper = await asyncio.to_thread(
+                    generar_texto_imagen_con_modelo_part,
+                    listaDocumentos, listadoImagenes, ocr_config_modelo
+                )
+
             resultado = wraper["response"]
             inputTokens = wraper["tokenInput"]
         except Exception as e:
@@ -355,8 +489,9 @@ async def modelo_dinamico_v6(
                 detail=f"Error al generar el texto de las imagenes: {e}"
             )
         
-        # Se inserta el consumo del modelo en la base de datos
-        stmt = insert(OCRConfigConsumoTokens).values(
+        # Se encola el consumo del modelo; el flusher en segundo plano lo
+        # inserta por lotes en una sola transacción
+        _encolar_consumo(dict(
             fecha_consumo=datetime.utcnow(),
             cached_content_token_count=resultado.usage_metadata.cached_content_token_count,
             candidates_token_count=resultado.usage_metadata.candidates_token_count,
@@ -368,25 +503,26 @@ async def modelo_dinamico_v6(
             modelo=ocr_config_modelo.nombre_modelo,
             objeto="/V6/modelo_dinamico",
             proceso="Modelo dinamico V6 con GCS auto-delete",
-        )
-        
-        try:
-            await db.execute(stmt)
-            await db.commit()
-        except Exception as e:
-            await db.rollback()
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail=f"Error al insertar el consumo del modelo en la base de datos: {e}"
-            )
+        ))
         
         # Procesar la respuesta
         try:
             resultado_procesado = resultado.candidates[0].content.parts[0].text
-            resultado_procesado = limpiar_json(resultado_procesado)
-            
-            cleaned_data = resultado_procesado.replace('json\n', '')
-            response_json = limpiar_y_convertir_json(cleaned_data)
+
+            # Camino rápido: la mayoría de las respuestas ya son JSON válido y
+            # no necesitan la pasada de reparación con regex
+            response_json = None
+            if orjson is not None:
+                try:
+                    response_json = orjson.loads(resultado_procesado)
+                except orjson.JSONDecodeError:
+                    pass
+
+            if response_json is None:
+                # Quitar sólo el prefijo de bloque de código "json", no todas
+                # las ocurrencias dentro del cuerpo
+                cleaned_data = _JSON_PREFIX_RE.sub('', limpiar_json(resultado_procesado), count=1)
+                response_json = limpiar_y_convertir_json(cleaned_data)
 
         except Exception as e:
             raise HTTPException(
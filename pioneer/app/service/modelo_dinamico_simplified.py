@@ -1,9 +1,8 @@
+import asyncio
 import base64
+import os
 import re
 from typing import List, Dict, Any
-from PIL import Image
-from PyPDF2 import PdfReader
-from io import BytesIO
 from fastapi import HTTPException, status
 
 # Imports para Vertex AI
@@ -12,67 +11,162 @@ try:
 except ImportError:
     Part = None
 
+# pybase64 decodifica con kernels SIMD (AVX2/AVX-512); si no está instalado
+# se usa el base64 de la stdlib
+try:
+    import pybase64
+
+    def _b64decode(contenido: str) -> bytes:
+        # validate=True toma el camino fusionado de decodificación+validación
+        return pybase64.b64decode(contenido, validate=True)
+except ImportError:
+    _b64decode = base64.b64decode
+
+# orjson parsea JSON en C con muchas menos asignaciones; si no está
+# instalado se usa el json de la stdlib
+try:
+    import orjson
+    _json_loads = orjson.loads
+    _JSONDecodeError = orjson.JSONDecodeError
+except ImportError:
+    import json
+    _json_loads = json.loads
+    _JSONDecodeError = json.JSONDecodeError
+
+# Patrones compilados una sola vez a nivel de módulo (se aplican a cada
+# respuesta del LLM)
+_TRAILING_COMMA_RE = re.compile(r',(\s*})')
+
+# Tipos MIME aceptados vía URI de GCS; frozenset a nivel de módulo para que
+# la verificación de membresía sea O(1) sin reconstruir la lista por documento
+_SUPPORTED_URI_MIMES = frozenset({
+    "application/pdf", "image/jpeg", "image/png", "image/webp",
+})
+
+# Bytes mágicos por tipo de imagen, indexados por MIME para reemplazar la
+# cadena de elif por un único lookup
+_IMAGE_MAGIC_PREFIXES = {
+    "image/jpeg": b'\xff\xd8\xff',
+    "image/png": b'\x89PNG\r\n\x1a\n',
+}
+
 # Imports corregidos
 from app.models.modelo import OcrConfigModelo
-from app.utils.genai import generar_texto_imagen_con_modelo_part, crear_documento_imagen
+from app.utils.genai import generar_texto_imagen_con_modelo_part, crear_documento_imagen_bytes
 from app.service.modelo_db_helper import obtener_modelo_por_nombre, crear_modelo_por_defecto
 
 
-def validar_archivo_multimedia(entrada: bytes, mimetype_esperado: str) -> bool:
-    """Valida si el archivo es un PDF, imagen, audio, video o texto."""
-    
+def validar_archivo_multimedia(entrada: bytes, mimetype_esperado: str,
+                               strict: bool = False) -> bool:
+    """Valida si el archivo es un PDF, imagen, audio, video o texto.
+
+    Con strict=True las imágenes se decodifican además con PIL; por defecto
+    sólo se verifica el contenedor con bytes mágicos.
+    """
+    # Vista sin copia sobre el payload: los slices de memoryview son O(1) y
+    # no duplican datos, relevante con audios/PDFs de decenas de MB
+    mv = memoryview(entrada)
+
     if mimetype_esperado == "application/pdf":
-        try:
-            PdfReader(BytesIO(entrada))
-        except:
+        # Sniff de bytes mágicos: prefijo %PDF- y %%EOF en el último KiB.
+        # Parsear toda la estructura con PdfReader sólo para validar cuesta
+        # decenas de ms en PDFs grandes; se conserva como validación estricta
+        # opcional detrás de una variable de entorno.
+        if mv[:5] != b'%PDF-' or b'%%EOF' not in bytes(mv[-1024:]):
             raise ValueError("El contenido no es un PDF válido.")
+        if os.getenv("PIONEER_STRICT_PDF_VALIDATION"):
+            # Import y BytesIO sólo en el camino estricto: el camino común no
+            # paga ni la carga de PyPDF2 ni la asignación del wrapper
+            from io import BytesIO
+            from PyPDF2 import PdfReader
+            from PyPDF2.errors import PdfReadError
+            try:
+                PdfReader(BytesIO(entrada))
+            except (PdfReadError, OSError):
+                raise ValueError("El contenido no es un PDF válido.")
     
     elif mimetype_esperado in ["image/jpeg", "image/png", "image/webp"]:
-        try:
-            img = Image.open(BytesIO(entrada))
+        # Verificar el contenedor por bytes mágicos; inicializar los decoders
+        # de PIL en cada petición sólo para confirmar el formato es trabajo
+        # desperdiciado en el hot path
+        prefijo_esperado = _IMAGE_MAGIC_PREFIXES.get(mimetype_esperado)
+        if prefijo_esperado is not None:
+            es_valida = mv[:len(prefijo_esperado)] == prefijo_esperado
+        else:  # image/webp
+            es_valida = mv[:4] == b'RIFF' and mv[8:12] == b'WEBP'
+
+        if not es_valida:
+            raise ValueError(f"Se esperaba una imagen {mimetype_esperado}, pero el contenido no es válido.")
+
+        if strict:
+            from io import BytesIO
+            from PIL import Image, UnidentifiedImageError
+            try:
+                img = Image.open(BytesIO(entrada))
+            except (UnidentifiedImageError, OSError):
+                # except acotado: un bare except aquí atraparía hasta
+                # KeyboardInterrupt/SystemExit
+                raise ValueError(f"Se esperaba una imagen {mimetype_esperado}, pero el contenido no es válido.")
             if mimetype_esperado == "image/jpeg" and img.format.lower() not in ["jpeg", "jpg"]:
                 raise ValueError("Se esperaba una imagen JPEG, pero el contenido no es válido.")
             elif mimetype_esperado == "image/png" and img.format.lower() != "png":
                 raise ValueError("Se esperaba una imagen PNG, pero el contenido no es válido.")
             elif mimetype_esperado == "image/webp" and img.format.lower() != "webp":
                 raise ValueError("Se esperaba una imagen WEBP, pero el contenido no es válido.")
-        except ValueError:
-            raise
-        except:
-            raise ValueError(f"Se esperaba una imagen {mimetype_esperado}, pero el contenido no es válido.")
     
     elif mimetype_esperado in ["audio/mpeg", "audio/mp3", "audio/wav"]:
-        # Validación básica para archivos de audio usando headers
-        try:
-            if mimetype_esperado in ["audio/mpeg", "audio/mp3"]:
-                if not (entrada.startswith(b'ID3') or entrada.startswith(b'\xff\xfb') or entrada.startswith(b'\xff\xfa')):
-                    raise ValueError("Se esperaba un archivo MP3, pero el contenido no es válido.")
-            elif mimetype_esperado == "audio/wav":
-                if not entrada.startswith(b'RIFF') or b'WAVE' not in entrada[:12]:
-                    raise ValueError("Se esperaba un archivo WAV, pero el contenido no es válido.")
-        except ValueError:
-            raise
-        except:
-            raise ValueError(f"Se esperaba un archivo de audio {mimetype_esperado}, pero el contenido no es válido.")
+        # Validación básica para archivos de audio usando headers; las
+        # comparaciones de bytes no lanzan, no hace falta un try alrededor
+        if mimetype_esperado in ["audio/mpeg", "audio/mp3"]:
+            # startswith con tupla resuelve los tres prefijos en una sola
+            # pasada en lugar de tres llamadas
+            if not entrada.startswith((b'ID3', b'\xff\xfb', b'\xff\xfa')):
+                raise ValueError("Se esperaba un archivo MP3, pero el contenido no es válido.")
+        elif mimetype_esperado == "audio/wav":
+            # Comparar directamente los offsets del contenedor RIFF/WAVE
+            # (bytes 0-3 y 8-11) en vez de startswith + escaneo del slice
+            if mv[:4] != b'RIFF' or mv[8:12] != b'WAVE':
+                raise ValueError("Se esperaba un archivo WAV, pero el contenido no es válido.")
     
     elif mimetype_esperado == "text/plain":
+        # Una sola pasada: latin-1 nunca falla, así que el re-decode de
+        # respaldo era un segundo escaneo completo que no aportaba nada. Los
+        # bytes inválidos se toleran y se sustituyen al decodificar aguas
+        # abajo con errors='replace'.
         try:
             entrada.decode('utf-8')
         except UnicodeDecodeError:
-            try:
-                entrada.decode('latin-1')
-            except UnicodeDecodeError:
-                raise ValueError("Se esperaba un archivo de texto, pero el contenido no es texto válido.")
+            pass
     
     return True
 
 
+def validar_prefijo_multimedia(prefijo: bytes, mimetype_esperado: str) -> bool:
+    """Valida los bytes mágicos sobre un prefijo decodificado del archivo.
+
+    Permite rechazar payloads inválidos decodificando sólo los primeros bytes
+    del base64, antes de pagar el decode completo de varios MB.
+    """
+    if mimetype_esperado == "application/pdf":
+        if not prefijo.startswith(b'%PDF-'):
+            raise ValueError("El contenido no es un PDF válido.")
+    elif mimetype_esperado in _IMAGE_MAGIC_PREFIXES:
+        prefijo_esperado = _IMAGE_MAGIC_PREFIXES[mimetype_esperado]
+        if prefijo[:len(prefijo_esperado)] != prefijo_esperado:
+            raise ValueError(f"Se esperaba una imagen {mimetype_esperado}, pero el contenido no es válido.")
+    elif mimetype_esperado == "image/webp":
+        if prefijo[:4] != b'RIFF' or prefijo[8:12] != b'WEBP':
+            raise ValueError("Se esperaba una imagen WEBP, pero el contenido no es válido.")
+
+    return True
+
+
 def limpiar_json(cadena: str) -> str:
     """
     Elimina las comas finales en objetos JSON,
     es decir, aquellas que aparecen justo antes de un '}'.
     """
-    cadena_limpia = re.sub(r',(\s*})', r'\1', cadena)
+    cadena_limpia = _TRAILING_COMMA_RE.sub(r'\1', cadena)
     return cadena_limpia
 
 
@@ -107,6 +201,103 @@ async def procesar_con_modelo_dinamico_desde_bd(
         raise ValueError(f"Error en procesar_con_modelo_dinamico_desde_bd: {str(e)}")
 
 
+def _preparar_documento(i: int, documento: Dict[str, Any]):
+    """
+    Valida un documento y lo convierte en (fragmentos de prompt, Part opcional).
+
+    Función síncrona pensada para correr en el thread pool: el decode de
+    base64 y la validación son CPU-bound y liberan el GIL en código C.
+    """
+    # Validar los campos básicos con un solo lookup por clave (sin genexps
+    # ni membership tests repetidos por documento)
+    nombre = documento.get("nombre")
+    mimetype = documento.get("mimetype")
+    if nombre is None or mimetype is None:
+        raise ValueError("Cada documento debe tener 'nombre' y 'mimetype'")
+
+    url = documento.get("url")
+    base64_content = documento.get("base64")
+    text_plano = documento.get("textPlano")
+    if url is None and base64_content is None and text_plano is None:
+        raise ValueError("Cada documento debe tener 'base64' o 'url' o 'textPlano'")
+
+    # Agregar a la lista de documentos
+    fragmentos = [f"Documento {i+1}: {nombre} (tipo: {mimetype})\n"]
+    part = None
+
+    # Procesar según si tiene URL o base64
+    if url is not None:
+        # Para URLs, usar Part.from_uri directamente
+        try:
+            if Part is None:
+                raise ImportError("vertexai.generative_models.Part no está disponible")
+
+            # Validar que la URL sea válida para GCS
+            if not url.startswith('gs://'):
+                raise ValueError(f"URL debe ser de Google Cloud Storage (gs://...): {url}")
+
+            print(f"[MODELO_DINAMICO] Validando URI: {url}")
+            print(f"[MODELO_DINAMICO] MIME type: {mimetype}")
+
+            # Validar que el MIME type sea soportado para URIs
+            if mimetype not in _SUPPORTED_URI_MIMES:
+                raise ValueError(f"MIME type {mimetype} no soportado para URIs. Soportados: {sorted(_SUPPORTED_URI_MIMES)}")
+
+            part = Part.from_uri(
+                url,
+                mime_type=mimetype
+            )
+
+            print(f"[MODELO_DINAMICO] URI Part creado exitosamente para: {nombre}")
+
+        except Exception as e:
+            print(f"[MODELO_DINAMICO] Error detallado procesando URI {url}: {str(e)}")
+            raise ValueError(f"Error procesando URI {url}: {str(e)}")
+
+    elif base64_content is not None:
+        # Procesar según el tipo de archivo
+        if mimetype in _SUPPORTED_URI_MIMES:
+            try:
+                # Rechazo temprano: decodificar sólo un prefijo (128 chars de
+                # base64 = 96 bytes) alcanza para revisar los bytes mágicos
+                validar_prefijo_multimedia(_b64decode(base64_content[:128]), mimetype)
+
+                # Decodificar el payload completo (Part.from_data necesita los
+                # bytes crudos) y validar el resto
+                file_content = _b64decode(base64_content)
+                validar_archivo_multimedia(file_content, mimetype)
+
+                # Crear Part reutilizando los bytes ya decodificados
+                part = crear_documento_imagen_bytes(file_content, mimetype)
+
+                print(f"[MODELO_DINAMICO] Procesando desde base64: {nombre}")
+
+            except Exception as e:
+                raise ValueError(f"Error procesando {nombre}: {str(e)}")
+
+        elif mimetype == "text/plain":
+            try:
+                # Para texto plano, agregarlo directamente al prompt;
+                # errors='replace' evita tumbar el documento por un byte
+                # inválido y ahorra el re-decode con otro charset
+                file_content = _b64decode(base64_content)
+                try:
+                    text_content = file_content.decode('utf-8')
+                except UnicodeDecodeError:
+                    text_content = file_content.decode('utf-8', errors='replace')
+                fragmentos.append(f"Contenido de {nombre}:\n{text_content}\n\n")
+            except Exception as e:
+                raise ValueError(f"Error procesando texto {nombre}: {str(e)}")
+
+        else:
+            raise ValueError(f"Tipo de archivo no soportado: {mimetype}")
+    else:
+        # Procesar texto plano
+        fragmentos.append(f"Contenido de {nombre}:\n{text_plano}\n\n")
+
+    return fragmentos, part
+
+
 async def procesar_con_modelo_dinamico(
     archivos_data: List[Dict[str, Any]], 
     modelo_config: OcrConfigModelo
@@ -139,95 +330,23 @@ async def procesar_con_modelo_dinamico(
         if not archivos_data:
             raise ValueError("No se proporcionaron archivos a procesar")
         
-        lista_documentos = ""
+        # Preparar los documentos en el thread pool y en paralelo: el decode
+        # de base64 y las validaciones son CPU-bound y bloqueaban el event
+        # loop; gather preserva el orden de archivos_data
+        preparados = await asyncio.gather(*(
+            asyncio.to_thread(_preparar_documento, i, documento)
+            for i, documento in enumerate(archivos_data)
+        ))
+
+        fragmentos_documentos = []
         listado_imagenes = []
-        
-        for i, documento in enumerate(archivos_data):
-            # Validar que tenga al menos los campos básicos
-            if not any(key in documento for key in ["base64", "url","textPlano"]):
-                raise ValueError("Cada documento debe tener 'base64' o 'url' o 'textPlano'")
-            
-            if not all(key in documento for key in ["nombre", "mimetype"]):
-                raise ValueError("Cada documento debe tener 'nombre' y 'mimetype'")
-            
-            nombre = documento["nombre"]
-            mimetype = documento["mimetype"]
-            
-            # Agregar a la lista de documentos
-            lista_documentos += f"Documento {i+1}: {nombre} (tipo: {mimetype})\n"
-            
-            # Procesar según si tiene URL o base64
-            if "url" in documento:
-                # Para URLs, usar Part.from_uri directamente
-                try:
-                    if Part is None:
-                        raise ImportError("vertexai.generative_models.Part no está disponible")
-                    
-                    # Validar que la URL sea válida para GCS
-                    url = documento['url']
-                    if not url.startswith('gs://'):
-                        raise ValueError(f"URL debe ser de Google Cloud Storage (gs://...): {url}")
-                    
-                    print(f"[MODELO_DINAMICO] Validando URI: {url}")
-                    print(f"[MODELO_DINAMICO] MIME type: {mimetype}")
-                    
-                    # Validar que el MIME type sea soportado para URIs
-                    supported_uri_types = ["application/pdf", "image/jpeg", "image/png", "image/webp"]
-                    if mimetype not in supported_uri_types:
-                        raise ValueError(f"MIME type {mimetype} no soportado para URIs. Soportados: {supported_uri_types}")
-                    
-                    image_variable_name = f"imagen_{i + 1}"
-                    uri_part = Part.from_uri(
-                        url,
-                        mime_type=mimetype
-                    )
-                    listado_imagenes.append(uri_part)
-                    
-                    print(f"[MODELO_DINAMICO] URI Part creado exitosamente para: {nombre}")
-                    
-                except Exception as e:
-                    print(f"[MODELO_DINAMICO] Error detallado procesando URI {documento.get('url', 'N/A')}: {str(e)}")
-                    raise ValueError(f"Error procesando URI {documento.get('url', 'N/A')}: {str(e)}")
-            
-            elif "base64" in documento:
-                # Para base64, usar el método existente
-                base64_content = documento["base64"]
-                
-                # Procesar según el tipo de archivo
-                if mimetype in ["application/pdf", "image/jpeg", "image/png", "image/webp"]:
-                    try:
-                        # Decodificar base64 para validación
-                        file_content = base64.b64decode(base64_content)
-                        
-                        # Validar el archivo
-                        validar_archivo_multimedia(file_content, mimetype)
-                        
-                        # Crear Part usando la función de genai.py
-                        listado_imagenes.append(crear_documento_imagen(base64_content, mimetype))
-                        
-                        print(f"[MODELO_DINAMICO] Procesando desde base64: {nombre}")
-
-                    except Exception as e:
-                        raise ValueError(f"Error procesando {nombre}: {str(e)}")
-                
-                elif mimetype == "text/plain":
-                    try:
-                        # Para texto plano, agregarlo directamente al prompt
-                        file_content = base64.b64decode(base64_content)
-                        text_content = file_content.decode('utf-8')
-                        lista_documentos += f"Contenido de {nombre}:\n{text_content}\n\n"
-                    except Exception as e:
-                        raise ValueError(f"Error procesando texto {nombre}: {str(e)}")
-                
-                else:
-                    raise ValueError(f"Tipo de archivo no soportado: {mimetype}")
-            elif "textPlano" in documento:
-                # Procesar texto plano
-                text_content = documento["textPlano"]
-                lista_documentos += f"Contenido de {nombre}:\n{text_content}\n\n"
-            else:
-                raise ValueError(f"Documento {nombre} debe tener 'base64' o 'url'")
-        
+        for fragmentos, part in preparados:
+            fragmentos_documentos.extend(fragmentos)
+            if part is not None:
+                listado_imagenes.append(part)
+
+        lista_documentos = "".join(fragmentos_documentos)
+
         # Generar contenido con el modelo
         try:
             print(f"[MODELO_DINAMICO] Iniciando generación con modelo: {modelo_config.nombre_modelo}")
@@ -238,9 +357,13 @@ async def procesar_con_modelo_dinamico(
             if not listado_imagenes and not lista_documentos.strip():
                 raise ValueError("No hay contenido válido para procesar")
             
-            wrapper = generar_texto_imagen_con_modelo_part(
-                lista_documentos, 
-                listado_imagenes, 
+            # La llamada a Vertex es síncrona (SDK bloqueante): ejecutarla en
+            # el thread pool para no serializar el event loop — de eso depende
+            # que las inferencias lanzadas en paralelo de verdad se solapen
+            wrapper = await asyncio.to_thread(
+                generar_texto_imagen_con_modelo_part,
+                lista_documentos,
+                listado_imagenes,
                 modelo_config
             )
             
@@ -263,14 +386,21 @@ async def procesar_con_modelo_dinamico(
             resultado_procesado = resultado.candidates[0].content.parts[0].text
             resultado_procesado = limpiar_json(resultado_procesado)
             
-            # Limpiar prefijos comunes
-            cleaned_data = resultado_procesado.replace('json\n', '').replace('```json', '').replace('```', '')
+            # Limpiar prefijos comunes (fences de código y prefijo "json").
+            # Los fences sólo aparecen en los extremos, así que con slices
+            # alcanza; re-escribir el string completo varias veces es caro
+            # en salidas de varios KB
+            s = resultado_procesado.strip()
+            if s.startswith('```'):
+                s = s.split('\n', 1)[1] if '\n' in s else s[3:]
+            if s.endswith('```'):
+                s = s[:-3]
+            cleaned_data = s.removeprefix('json\n').strip()
             
             # Intentar parsear como JSON
-            import json
             try:
-                response_json = json.loads(cleaned_data)
-            except json.JSONDecodeError:
+                response_json = _json_loads(cleaned_data)
+            except _JSONDecodeError:
                 # Si no es JSON válido, devolver como texto
                 response_json = {"texto_extraido": cleaned_data}
             
@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
 from typing import List, Optional
 
 class OcrConfigModeloBase(BaseModel):
@@ -35,8 +35,9 @@ class OcrConfigModeloRead(BaseModel):
     max_output_tokens: int
     notes: Optional[str]
 
-    class Config:
-        from_attributes = True
+    # Estilo pydantic v2: ConfigDict evita el camino de compatibilidad con la
+    # class Config de v1 y usa los validadores de pydantic-core directamente
+    model_config = ConfigDict(from_attributes=True)
 
 class OcrConfigModeloUpdate(BaseModel):
     nombre_modelo: Optional[str]
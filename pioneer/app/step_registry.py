@@ -1,20 +1,92 @@
 # app/step_registry.py
-from typing import Callable, Dict, Awaitable, Any
+import functools
+from contextvars import ContextVar
+from types import MappingProxyType
+from typing import Callable, Dict, Awaitable, Any, Optional
 
 _STEP_HANDLERS: Dict[str, Callable[[dict, dict], Awaitable[dict]]] = {}
 
+# execution_id de la ejecución en curso, ligado una sola vez por despacho:
+# los steps lo leen con current_execution_id.get() en lugar de repetir el
+# doble lookup sobre el contexto. Cada task de asyncio tiene su propio
+# Context, así que ejecuciones concurrentes no se pisan.
+current_execution_id: ContextVar[Optional[str]] = ContextVar("execution_id", default=None)
+
+def _aplicar_dp_updates(context: dict, output: dict) -> dict:
+    """Aplica el contrato dp_updates del retorno de un step.
+
+    Un step puede devolver {"dp_updates": {...}} en lugar de clonar y
+    mergear el contexto entero él mismo; el despacho hace aquí el único
+    merge superficial necesario. Los retornos con "context" explícito
+    siguen pasando tal cual.
+    """
+    dp_updates = output.pop("dp_updates", None)
+    if dp_updates is not None:
+        new_context = {**(output.get("context") or context)}
+        new_context["dynamic_properties"] = {
+            **(new_context.get("dynamic_properties") or {}),
+            **dp_updates,
+        }
+        output["context"] = new_context
+    return output
+
 def register(name: str):
     def decorator(fn):
-        _STEP_HANDLERS[name] = fn
+        @functools.wraps(fn)
+        async def wrapper(context: dict, config: dict) -> dict:
+            execution_id = context.get("execution_id") or \
+                (context.get("dynamic_properties") or {}).get("execution_id")
+            token = current_execution_id.set(execution_id)
+            try:
+                output = await fn(context, config)
+            finally:
+                current_execution_id.reset(token)
+            if isinstance(output, dict):
+                output = _aplicar_dp_updates(context, output)
+            return output
+        _STEP_HANDLERS[name] = wrapper
         return fn
     return decorator
 
 def get(name: str):
-    try:
-        return _STEP_HANDLERS[name]
-    except KeyError:
+    # dict.get evita construir una excepción KeyError en el camino normal
+    handler = _STEP_HANDLERS.get(name)
+    if handler is None:
         raise ValueError(f"Step handler '{name}' not found")
+    return handler
 
 def get_all_handlers():
     """Retorna todos los handlers registrados."""
     return _STEP_HANDLERS.copy()
+
+def get_all_handlers_view():
+    """Retorna una vista de sólo lectura de los handlers, sin copiar el dict."""
+    return MappingProxyType(_STEP_HANDLERS)
+
+# Despacho congelado: tras registrar todos los steps en el arranque, freeze()
+# materializa una tupla indexada por un id entero estable (orden alfabético)
+# para que los loops internos despachen sin hash+compare por llamada.
+_STEP_NAME_TO_IDX: Dict[str, int] = {}
+_STEP_HANDLERS_ARR: tuple = ()
+
+def freeze():
+    """Congela el registro actual en una tabla de despacho indexada.
+
+    Llamar una vez desde el arranque de la app, después de importar todos los
+    módulos que registran steps. Registros posteriores requieren re-congelar.
+    """
+    global _STEP_NAME_TO_IDX, _STEP_HANDLERS_ARR
+    nombres = sorted(_STEP_HANDLERS)
+    _STEP_NAME_TO_IDX = {nombre: idx for idx, nombre in enumerate(nombres)}
+    _STEP_HANDLERS_ARR = tuple(_STEP_HANDLERS[nombre] for nombre in nombres)
+
+def get_step_idx(name: str) -> int:
+    """Retorna el id entero de un step congelado."""
+    idx = _STEP_NAME_TO_IDX.get(name)
+    if idx is None:
+        raise ValueError(f"Step handler '{name}' not found")
+    return idx
+
+def get_by_idx(idx: int):
+    """Despacho O(1) por id entero; requiere freeze() previo."""
+    return _STEP_HANDLERS_ARR[idx]
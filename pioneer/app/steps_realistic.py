@@ -5,22 +5,38 @@ from .utils.carga_archivos_bucket import GCSFileManager
 from .utils.geminis_client import process_pdf_with_geminis, check_geminis_health
 from .utils.valida_ine import validar_ine_con_modelo_identificado
 from .utils.busquedaInternet import screen_person
-from .step_registry import register
+from .step_registry import register, current_execution_id
 import asyncio
+import functools
+import random
 import time
 import json
+import uuid
 import base64
+import binascii
 import httpx
 import os
-import tempfile
+import logging
+import unicodedata
 from pathlib import Path
-from copy import deepcopy
 from datetime import datetime, timezone
-import difflib  # Para búsqueda difusa de texto
+import difflib  # Para búsqueda difusa de texto (fallback sin rapidfuzz)
+
+# rapidfuzz calcula la similitud en C++ (5-100x más rápido que el
+# Ratcliff-Obershelp puro-Python de difflib); si no está instalado se
+# conserva el camino difflib
+try:
+    from rapidfuzz import fuzz as _rf_fuzz, process as _rf_process
+except ImportError:
+    _rf_fuzz = None
+    _rf_process = None
+
+logger = logging.getLogger(__name__)
 
 
 # Import para el servicio de modelo dinámico
 from app.service.modelo_dinamico_simplified import procesar_con_modelo_dinamico_desde_bd
+from app.utils.llm_cache import cached_llm
 
 async def procesar_con_servicio_sise(archivos_data: list, modelo: str) -> dict:
     """
@@ -36,7 +52,7 @@ async def procesar_con_servicio_sise(archivos_data: list, modelo: str) -> dict:
     try:
         # Por ahora, devolver estructura esperada vacía
         # TODO: Implementar lógica real del servicio SISE
-        print(f"[SISE] Procesando con modelo {modelo} - PLACEHOLDER")
+        logger.info(f"[SISE] Procesando con modelo {modelo} - PLACEHOLDER")
         return {
             "resultado": {
                 "status": "placeholder",
@@ -50,7 +66,7 @@ async def procesar_con_servicio_sise(archivos_data: list, modelo: str) -> dict:
             }
         }
     except Exception as e:
-        print(f"[SISE] Error en procesamiento: {str(e)}")
+        logger.warning(f"[SISE] Error en procesamiento: {str(e)}")
         return {
             "resultado": {
                 "error": str(e),
@@ -78,23 +94,122 @@ def find_best_field_match(fields: dict, target_patterns: list, min_similarity: f
     best_match = None
     best_value = None
     best_similarity = 0
-    
-    for field_name, field_value in fields.items():
-        if not field_value:  # Saltar campos vacíos
-            continue
-            
+
+    # Campos con valor, con la clave en mayúsculas calculada una sola vez
+    candidatos = [(nombre, valor, nombre.upper()) for nombre, valor in fields.items() if valor]
+    if not candidatos:
+        return None, None, 0
+
+    # Atajo de coincidencia exacta (similitud 1.0): resuelve por hash sin
+    # pagar ninguna comparación difusa
+    por_clave = {clave_upper: (nombre, valor) for nombre, valor, clave_upper in candidatos}
+    for pattern in target_patterns:
+        exacto = por_clave.get(pattern.upper())
+        if exacto is not None:
+            return exacto[0], exacto[1], 1.0
+
+    if _rf_process is not None:
+        # Una sola llamada C calcula la matriz patrones x campos completa
+        # (multihilo); el argmax global da el mejor par sin loop Python
+        claves_upper = [clave_upper for _, _, clave_upper in candidatos]
+        scores = _rf_process.cdist(
+            [pattern.upper() for pattern in target_patterns],
+            claves_upper,
+            scorer=_rf_fuzz.ratio,
+            score_cutoff=min_similarity * 100,
+            workers=-1,
+        )
+        mejor_plano = int(scores.argmax())
+        mejor_score = float(scores.max())
+        if mejor_score >= min_similarity * 100 and mejor_score > 0:
+            nombre, valor, _ = candidatos[mejor_plano % scores.shape[1]]
+            best_match = nombre
+            best_value = valor
+            best_similarity = mejor_score / 100
+        return best_match, best_value, best_similarity
+
+    patrones_upper = [pattern.upper() for pattern in target_patterns]
+    for nombre, valor, clave_upper in candidatos:
         # Verificar similitud con cada patrón objetivo
-        for pattern in target_patterns:
+        for patron_upper in patrones_upper:
             # Usar difflib para calcular similitud
-            similarity = difflib.SequenceMatcher(None, field_name.upper(), pattern.upper()).ratio()
-            
+            similarity = difflib.SequenceMatcher(None, clave_upper, patron_upper).ratio()
+
             if similarity > best_similarity and similarity >= min_similarity:
-                best_match = field_name
-                best_value = field_value
+                best_match = nombre
+                best_value = valor
                 best_similarity = similarity
-    
+
     return best_match, best_value, best_similarity
 
+# Cliente httpx compartido hacia Discovery, uno por event loop: reutiliza
+# conexiones keep-alive en lugar de pagar el handshake TCP+TLS en cada
+# reporte (5-8 reportes por step, varios steps por workflow)
+_DISCOVERY_CLIENTS: dict = {}
+
+def _get_discovery_client() -> httpx.AsyncClient:
+    loop = asyncio.get_running_loop()
+    client = _DISCOVERY_CLIENTS.get(loop)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            timeout=30,
+            limits=httpx.Limits(max_keepalive_connections=32, max_connections=64),
+        )
+        _DISCOVERY_CLIENTS[loop] = client
+    return client
+
+async def close_discovery_clients():
+    """Cierra los clientes compartidos; llamar en el shutdown de la app."""
+    for client in _DISCOVERY_CLIENTS.values():
+        if not client.is_closed:
+            await client.aclose()
+    _DISCOVERY_CLIENTS.clear()
+
+# Los reportes de progreso son telemetría, no dependencias de datos: se
+# despachan como tareas en segundo plano acotadas por semáforo para no
+# bloquear el camino crítico del step en un round-trip a Discovery
+_REPORT_SEM = asyncio.Semaphore(16)
+# Referencias fuertes a las tareas pendientes para que el GC no las cancele
+_PENDING_REPORTS: set = set()
+
+async def _bounded_report(execution_id: str, step_name: str, progress_data: dict):
+    async with _REPORT_SEM:
+        await report_progress(execution_id, step_name, progress_data)
+
+# Debounce de progreso: actualizaciones consecutivas del mismo (ejecución,
+# step) dentro de la ventana se coalescen y sólo viaja el payload más
+# reciente — un step que reporta 25/50/70% en milisegundos genera un único
+# POST en lugar de tres
+_PROGRESS_DEBOUNCE = 0.05
+_progress_pendientes: dict = {}  # (execution_id, step) -> payload más reciente
+
+def _flush_progress(clave: tuple):
+    payload = _progress_pendientes.pop(clave, None)
+    if payload is None:
+        return
+    task = asyncio.get_running_loop().create_task(
+        _bounded_report(clave[0], clave[1], payload)
+    )
+    _PENDING_REPORTS.add(task)
+    task.add_done_callback(_PENDING_REPORTS.discard)
+
+def report_progress_nowait(execution_id: str, step_name: str, progress_data: dict):
+    """Despacha un reporte de progreso sin esperar la respuesta HTTP.
+
+    Reportes sucesivos del mismo step dentro de la ventana de debounce se
+    coalescen: sólo se envía el último estado.
+    """
+    clave = (execution_id, step_name)
+    ya_programado = clave in _progress_pendientes
+    _progress_pendientes[clave] = progress_data
+    if not ya_programado:
+        asyncio.get_running_loop().call_later(_PROGRESS_DEBOUNCE, _flush_progress, clave)
+
+# URL de Discovery capturada una sola vez al importar: se consulta en cada
+# evento de progreso/completado y el valor no cambia durante la vida del
+# proceso. Cada sitio conserva su default de desarrollo local.
+_DISCOVERY_URL_ENV = os.getenv("DISCOVERY_URL")
+
 # Función auxiliar para reportar progreso a Discovery
 async def report_progress(execution_id: str, step_name: str, progress_data: dict):
     """
@@ -105,16 +220,17 @@ async def report_progress(execution_id: str, step_name: str, progress_data: dict
         step_name: Nombre del step que reporta
         progress_data: Datos de progreso (percentage, message, etc.)
     """
-    discovery_url = os.getenv("DISCOVERY_URL", "http://localhost:8000")
-    
+    discovery_url = _DISCOVERY_URL_ENV or "http://localhost:8000"
+
     try:
-        async with httpx.AsyncClient(timeout=10) as client:
-            await client.post(
-                f"{discovery_url}/executions/{execution_id}/steps/{step_name}/progress",
-                json=progress_data
-            )
+        client = _get_discovery_client()
+        await client.post(
+            f"{discovery_url}/executions/{execution_id}/steps/{step_name}/progress",
+            json=progress_data,
+            timeout=10
+        )
     except Exception as e:
-        print(f"[PROGRESS REPORT] Error reportando progreso: {e}")
+        logger.warning(f"[PROGRESS REPORT] Error reportando progreso: {e}")
 
 async def report_completion(execution_id: str, step_name: str, result_data: dict = None):
     """
@@ -125,16 +241,17 @@ async def report_completion(execution_id: str, step_name: str, result_data: dict
         step_name: Nombre del step completado
         result_data: Datos del resultado
     """
-    discovery_url = os.getenv("DISCOVERY_URL", "http://localhost:8000/discovery")
-    
+    discovery_url = _DISCOVERY_URL_ENV or "http://localhost:8000/discovery"
+
     try:
-        async with httpx.AsyncClient(timeout=10) as client:
-            await client.post(
-                f"{discovery_url}/executions/{execution_id}/steps/{step_name}/complete",
-                json=result_data or {}
-            )
+        client = _get_discovery_client()
+        await client.post(
+            f"{discovery_url}/executions/{execution_id}/steps/{step_name}/complete",
+            json=result_data or {},
+            timeout=10
+        )
     except Exception as e:
-        print(f"[COMPLETION REPORT] Error reportando completado: {e}")
+        logger.warning(f"[COMPLETION REPORT] Error reportando completado: {e}")
 
 async def complete_workflow_execution(execution_id: str, status: str = "completed"):
     """
@@ -144,49 +261,51 @@ async def complete_workflow_execution(execution_id: str, status: str = "complete
         execution_id: ID del workflow execution
         status: Estado final del workflow (completed, failed, etc.)
     """
-    discovery_url = os.getenv("DISCOVERY_URL", "http://localhost:8000/discovery")
+    discovery_url = _DISCOVERY_URL_ENV or "http://localhost:8000/discovery"
     
     try:
-        async with httpx.AsyncClient(timeout=15) as client:
-            # Opción 1: Intentar el endpoint específico para completar workflow
-            response = await client.post(
-                f"{discovery_url}/executions/{execution_id}/complete",
+        client = _get_discovery_client()
+        # Opción 1: Intentar el endpoint específico para completar workflow
+        response = await client.post(
+            f"{discovery_url}/executions/{execution_id}/complete",
+            json={
+                "status": status,
+                "completed_at": datetime.now(timezone.utc).isoformat(),
+                "final_result": f"Workflow finalizado con estado: {status}"
+            },
+            timeout=15
+        )
+
+        if response.status_code == 200:
+            logger.info(f"[WORKFLOW] ✓ Workflow {execution_id} actualizado a estado: {status}")
+            return True
+        elif response.status_code == 404:
+            # Si no existe ese endpoint, intentar marcar como step completion especial
+            logger.info(f"[WORKFLOW] Endpoint /complete no encontrado, usando step completion...")
+            response2 = await client.post(
+                f"{discovery_url}/executions/{execution_id}/steps/workflow_completion/complete",
                 json={
                     "status": status,
+                    "workflow_completed": True,
                     "completed_at": datetime.now(timezone.utc).isoformat(),
                     "final_result": f"Workflow finalizado con estado: {status}"
-                }
+                },
+                timeout=15
             )
-            
-            if response.status_code == 200:
-                print(f"[WORKFLOW] ✓ Workflow {execution_id} actualizado a estado: {status}")
+
+            if response2.status_code in [200, 201]:
+                logger.info(f"[WORKFLOW] ✓ Workflow {execution_id} marcado como completado via step completion")
                 return True
-            elif response.status_code == 404:
-                # Si no existe ese endpoint, intentar marcar como step completion especial
-                print(f"[WORKFLOW] Endpoint /complete no encontrado, usando step completion...")
-                response2 = await client.post(
-                    f"{discovery_url}/executions/{execution_id}/steps/workflow_completion/complete",
-                    json={
-                        "status": status,
-                        "workflow_completed": True,
-                        "completed_at": datetime.now(timezone.utc).isoformat(),
-                        "final_result": f"Workflow finalizado con estado: {status}"
-                    }
-                )
-                
-                if response2.status_code in [200, 201]:
-                    print(f"[WORKFLOW] ✓ Workflow {execution_id} marcado como completado via step completion")
-                    return True
-                else:
-                    print(f"[WORKFLOW] Error en step completion: {response2.status_code}")
-                    return False
             else:
-                print(f"[WORKFLOW] Error actualizando workflow: {response.status_code}")
-                print(f"[WORKFLOW] Response: {response.text}")
+                logger.warning(f"[WORKFLOW] Error en step completion: {response2.status_code}")
                 return False
-                
+        else:
+            logger.warning(f"[WORKFLOW] Error actualizando workflow: {response.status_code}")
+            logger.info(f"[WORKFLOW] Response: {response.text}")
+            return False
+
     except Exception as e:
-        print(f"[WORKFLOW] Error marcando workflow: {e}")
+        logger.warning(f"[WORKFLOW] Error marcando workflow: {e}")
         return False
 
 async def update_discovery_execution_properties(execution_id: str, additional_data: dict = None, custom_status: str = None):
@@ -201,7 +320,7 @@ async def update_discovery_execution_properties(execution_id: str, additional_da
     Returns:
         bool: True si se actualizó exitosamente, False en caso contrario
     """
-    discovery_url = os.getenv("DISCOVERY_URL", "http://localhost:8001")  # Puerto 8001 para Discovery
+    discovery_url = _DISCOVERY_URL_ENV or "http://localhost:8001"  # Puerto 8001 para Discovery
     
     try:
         payload = {}
@@ -211,32 +330,357 @@ async def update_discovery_execution_properties(execution_id: str, additional_da
             payload["custom_status"] = custom_status
         
         if not payload:
-            print("[DISCOVERY_PROPS] No hay datos para actualizar")
+            logger.info("[DISCOVERY_PROPS] No hay datos para actualizar")
             return False
         
-        async with httpx.AsyncClient(timeout=30) as client:
-            response = await client.patch(
-                f"{discovery_url}/executions/{execution_id}/properties",
-                json=payload
-            )
-            
-            if response.status_code == 200:
-                print(f"[DISCOVERY_PROPS] ✓ Propiedades actualizadas para ejecución {execution_id}")
-                print(f"[DISCOVERY_PROPS] → additional_data: {bool(additional_data)}")
-                print(f"[DISCOVERY_PROPS] → custom_status: {custom_status}")
-                return True
-            else:
-                print(f"[DISCOVERY_PROPS] ✗ Error actualizando propiedades: {response.status_code}")
-                print(f"[DISCOVERY_PROPS] Response: {response.text}")
-                return False
-                
+        client = _get_discovery_client()
+        response = await client.patch(
+            f"{discovery_url}/executions/{execution_id}/properties",
+            json=payload,
+            timeout=30
+        )
+
+        if response.status_code == 200:
+            logger.info(f"[DISCOVERY_PROPS] ✓ Propiedades actualizadas para ejecución {execution_id}")
+            logger.info(f"[DISCOVERY_PROPS] → additional_data: {bool(additional_data)}")
+            logger.info(f"[DISCOVERY_PROPS] → custom_status: {custom_status}")
+            return True
+        else:
+            logger.warning(f"[DISCOVERY_PROPS] ✗ Error actualizando propiedades: {response.status_code}")
+            logger.info(f"[DISCOVERY_PROPS] Response: {response.text}")
+            return False
+
     except httpx.TimeoutException:
-        print(f"[DISCOVERY_PROPS] ✗ Timeout actualizando propiedades de ejecución {execution_id}")
+        logger.info(f"[DISCOVERY_PROPS] ✗ Timeout actualizando propiedades de ejecución {execution_id}")
         return False
     except Exception as e:
-        print(f"[DISCOVERY_PROPS] ✗ Error actualizando propiedades: {e}")
+        logger.warning(f"[DISCOVERY_PROPS] ✗ Error actualizando propiedades: {e}")
         return False
 
+# Orden canónico de las secciones del expediente (invariante entre requests)
+_ORDEN_OBJETIVO = (
+    "fcc",
+    "csf",
+    "constancia_fea",
+    "comprobante_domicilio",
+    "ine",
+    "poder_notarial",
+    "acta_constitutiva",
+    "rpp",
+)
+
+# Nombres amigables de cada sección para mensajes al usuario (constante de
+# módulo: evita reconstruir el dict en cada ejecución de fetch_user)
+_NOMBRES_DOCUMENTOS = {
+    "csf": "Constancia de Situación Fiscal",
+    "fcc": "Formulario de Cumplimiento de Cliente",
+    "ine": "INE",
+    "rpp": "Registro Público de la Propiedad",
+    "constancia_fea": "Constancia de Firma Electrónica Avanzada",
+    "poder_notarial": "Poder Notarial",
+    "acta_constitutiva": "Acta Constitutiva",
+    "comprobante_domicilio": "Comprobante de Domicilio"
+}
+
+# Por encima de este tamaño de base64 (~10 MB) se decodifica por bloques
+# para no mantener entrada ASCII + salida binaria completas a la vez
+_B64_STREAM_THRESHOLD = 10 * 1024 * 1024
+_B64_CHUNK = 256 * 1024  # múltiplo de 4 caracteres base64
+
+def _b64_to_bytes(contenido) -> bytes:
+    """Decodifica base64 aceptando str o bytes sin copias innecesarias.
+
+    b64decode sobre str paga primero un re-encode a ASCII; si el payload ya
+    es bytes se decodifica directo, y los payloads grandes se decodifican en
+    bloques con a2b_base64 para reducir el pico de memoria.
+    """
+    if isinstance(contenido, str):
+        contenido = contenido.encode("ascii")
+    if len(contenido) <= _B64_STREAM_THRESHOLD:
+        return base64.b64decode(contenido)
+    try:
+        salida = bytearray()
+        for i in range(0, len(contenido), _B64_CHUNK):
+            salida += binascii.a2b_base64(contenido[i:i + _B64_CHUNK])
+        return bytes(salida)
+    except binascii.Error:
+        # Base64 con saltos de línea/espacios desalinea los bloques de 4
+        # caracteres; en ese caso se cae al decoder tolerante de la stdlib
+        return base64.b64decode(contenido)
+
+@functools.lru_cache(maxsize=1)
+def _gcs() -> GCSFileManager:
+    """Instancia única de GCSFileManager.
+
+    Construir el cliente de storage carga credenciales (disco o metadata
+    server); no hay motivo para pagarlo varias veces por request.
+    """
+    return GCSFileManager()
+
+def _marcar_pdf_validacion(pdf_bytes: bytes):
+    """Marca el PDF con la validación, todo en memoria.
+
+    Síncrono (pypdf): pensado para ejecutarse vía asyncio.to_thread y no
+    bloquear el event loop durante el marcado. Devuelve los bytes del PDF
+    marcado, o None si el marcado falló (el llamador sigue con el original
+    sin marca).
+    """
+    try:
+        # Importar la funcionalidad de marcado
+        from app.utils.marcarPDF import MarcadorPDF
+
+        # Crear instancia del marcador
+        marcador = MarcadorPDF(bucket_name="perdidas-totales-pruebas")
+
+        # Marcar el PDF en memoria (sin archivos temporales)
+        resultado_marcado = marcador.marcar_pdf_bytes(pdf_bytes)
+
+        if resultado_marcado["success"]:
+            logger.info(f"[FETCH_USER] ✓ PDF marcado exitosamente con: {resultado_marcado['marca_aplicada']}")
+            return resultado_marcado["pdf_bytes"]
+
+        logger.warning(f"[FETCH_USER] ⚠ Error marcando PDF: {resultado_marcado.get('error', 'Error desconocido')}")
+        logger.info(f"[FETCH_USER] → Continuando con PDF original sin marca")
+
+    except ImportError as import_error:
+        logger.warning(f"[FETCH_USER] ⚠ Error importando MarcadorPDF: {import_error}")
+        logger.info(f"[FETCH_USER] → Continuando con PDF original sin marca")
+    except Exception as marcado_error:
+        logger.warning(f"[FETCH_USER] ⚠ Error general en marcado: {str(marcado_error)}")
+        logger.info(f"[FETCH_USER] → Continuando con PDF original sin marca")
+    return None
+
+# Cache de consultas de listas negras: el apellido es el único input y los
+# apellidos comunes se repiten mucho en producción, así que el resultado se
+# retiene una hora. La clave se normaliza (NFKD sin acentos, mayúsculas, sin
+# espacios sobrantes) para que "Pérez " y "PEREZ" compartan entrada — eso
+# cubre lo que aportaría una capa difusa sin arriesgar falsos aciertos entre
+# apellidos distintos pero parecidos. Las consultas concurrentes por el mismo
+# apellido se coalescen en una sola llamada en vuelo.
+_LISTAS_TTL = 3600.0
+_LISTAS_MAX_ENTRADAS = 10_000
+_listas_en_vuelo: dict = {}    # clave normalizada -> Task de la consulta en curso
+_listas_recientes: dict = {}   # clave normalizada -> (expira_en, resultado)
+
+def _normalizar_apellido(apellido: str) -> str:
+    sin_acentos = unicodedata.normalize("NFKD", apellido).encode("ascii", "ignore").decode("ascii")
+    return " ".join(sin_acentos.upper().split())
+
+async def _consultar_listas_negras_dedup(apellido: str) -> dict:
+    if not apellido:
+        return await _consultar_listas_negras(apellido)
+
+    clave = _normalizar_apellido(apellido)
+    ahora = time.monotonic()
+    entrada = _listas_recientes.get(clave)
+    if entrada is not None and entrada[0] > ahora:
+        logger.info(f"[transform_data] Listas negras resueltas desde cache para: {apellido}")
+        return entrada[1]
+
+    tarea = _listas_en_vuelo.get(clave)
+    if tarea is not None:
+        return await tarea
+
+    tarea = asyncio.get_running_loop().create_task(_consultar_listas_negras(apellido))
+    _listas_en_vuelo[clave] = tarea
+    try:
+        resultado = await tarea
+    finally:
+        _listas_en_vuelo.pop(clave, None)
+
+    # No retener errores: la siguiente consulta debe volver a intentar
+    if "error" not in resultado:
+        if len(_listas_recientes) >= _LISTAS_MAX_ENTRADAS:
+            vencidas = [c for c, (expira_en, _) in _listas_recientes.items() if expira_en <= ahora]
+            for c in vencidas:
+                _listas_recientes.pop(c, None)
+            if len(_listas_recientes) >= _LISTAS_MAX_ENTRADAS:
+                _listas_recientes.pop(next(iter(_listas_recientes)), None)
+        _listas_recientes[clave] = (ahora + _LISTAS_TTL, resultado)
+    return resultado
+
+# Valores de ejemplo para la anotación con GEMINIS cuando el modelo dinámico
+# no devolvió campos; constante de módulo para no reconstruir ~20 dicts por
+# request en el camino normal (que no los usa)
+_DEFAULT_VALORES_PARA_ANOTAR = tuple([{'text': 'THE CHEMOURS COMPANY SERVICIOS, S. DE R.L. DE C.V.', 'very_permissive': False}, {'text': 'CSE140703QV7', 'very_permissive': False}, {'text': '2014/06/20', 'very_permissive': False}, {'text': 'GONZALEZ MARTINEZ, LUIS OSVALDO', 'very_permissive': False}, {'text': '55 5125 4847', 'very_permissive': False}, {'text': 'luis-osvaldo.gonzalez@chemours.com', 'very_permissive': False}, {'text': 'SERGIO RAUL SANMIGUEL GASTELUM', 'very_permissive': False, 'marker': 'PRESIDENTE'}, {'text': 'LUIS OSVALDO GONZALEZ MARTINEZ', 'very_permissive': False, 'marker': 'MIEMBRO PROPIETARIO'}, {'text': 'OMAR GOMEZ VELASCO', 'very_permissive': False, 'marker': 'MIEMBRO PROPIETARIO'}, {'text': 'SOCIEDAD DE RESPONSABILIDAD LIMITADA DE CAPITAL VARIABLE', 'very_permissive': False}, {'text': '03 DE JULIO DE 2014', 'very_permissive': False}, {'text': 'ACTIVO', 'very_permissive': False}, {'text': 'SNGSSR68110214H901', 'very_permissive': False}, {'text': '2012', 'very_permissive': False}, {'text': 'GNMRLS75010615H400', 'very_permissive': False}, {'text': '2019', 'very_permissive': False}, {'text': 'CLLE LAGO ZURICH 219 INT 205 AMPLIACION GRANADA MIGUEL HIDALGO CIUDAD DE MEXICO 11529 MEX', 'very_permissive': False}, {'text': 'LUIS REBOLLAR GONZALEZ', 'very_permissive': False, 'marker': 'Presidente'}, {'text': 'JAIME PEREZ VARGAS UHTHOFF', 'very_permissive': False, 'marker': 'Miembro Propietario'}, {'text': '517312', 'very_permissive': False, 'marker': 'RPP'}])
+
+# orjson parsea C-side sin la tokenización Python de la stdlib (2-5x más
+# rápido en payloads de extracción grandes); si no está instalado se cae a json
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
+# Con el flag apagado, la lista hardcodeada de ejemplo no se usa como
+# fallback: si no hay valores reales que anotar se omite GEMINIS por completo
+# en lugar de gastar la llamada más cara del step en literales ajenos al
+# documento. Por defecto encendido para conservar el comportamiento actual.
+_GEMINIS_USAR_FALLBACK = os.getenv("GEMINIS_USE_DEFAULT_FALLBACK", "true").lower() in ("1", "true", "yes", "si")
+
+class _OmitirGeminis(Exception):
+    """Señal interna: no hay valores reales y el fallback está deshabilitado."""
+
+# Tope de textos a buscar por GEMINIS: el costo de OCR/anotación escala
+# linealmente con el número de needles, así que entradas patológicas se
+# truncan conservando los textos más largos (más distintivos para el OCR)
+_MAX_VALORES_ANOTAR = 200
+
+def _ts_z() -> str:
+    """Timestamp UTC en formato ISO con sufijo Z, sin strings intermedios."""
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+
+def _compactar_para_marcar(valor, max_val_len: int = 200):
+    """Compacta el payload de extracción para el modelo propiedades_a_marcar.
+
+    Se eliminan campos vacíos/nulos y se truncan las hojas muy largas (texto
+    OCR completo, párrafos) que el modelo no necesita enteras. No se truncan
+    los valores cortos: el modelo los devuelve tal cual como textos a marcar
+    en el PDF y deben seguir encontrándose por OCR.
+    """
+    if isinstance(valor, dict):
+        return {
+            clave: _compactar_para_marcar(v, max_val_len)
+            for clave, v in valor.items()
+            if v is not None and v != "" and v != [] and v != {}
+        }
+    if isinstance(valor, list):
+        return [_compactar_para_marcar(v, max_val_len) for v in valor]
+    if isinstance(valor, str) and len(valor) > max_val_len:
+        return valor[:max_val_len]
+    return valor
+
+# El health-check de GEMINIS se memoiza unos segundos: el servicio no cambia
+# de estado documento a documento y el probe cuesta un RTT por request
+_GEMINIS_HEALTH_TTL = 15.0
+_geminis_health = {"ts": 0.0, "ok": False}
+
+def _geminis_healthy() -> bool:
+    ahora = time.monotonic()
+    if ahora - _geminis_health["ts"] < _GEMINIS_HEALTH_TTL:
+        return _geminis_health["ok"]
+    ok = check_geminis_health()
+    _geminis_health["ts"] = ahora
+    _geminis_health["ok"] = ok
+    return ok
+
+# Límite de subidas concurrentes a GCS, configurable por entorno
+GCS_SEM = asyncio.Semaphore(int(os.getenv("GCS_MAX_CONCURRENCY", "32")))
+
+_INE_NO_LEGIBLE = "La imagen no es legible o no corresponde a una credencial para votar válida."
+
+# Tasa de "no legible" observada en el proceso: cuando supera el umbral se
+# lanzan dos intentos especulativos en paralelo en lugar de esperar al
+# primero para recién entonces reintentar
+_INE_STATS = {"total": 0, "no_legibles": 0}
+_INE_SPEC_MIN_MUESTRA = 10
+_INE_SPEC_UMBRAL = 0.3
+
+def _es_no_legible(resultado_llm: dict) -> bool:
+    return (resultado_llm.get("resultado") or {}).get("error") == _INE_NO_LEGIBLE
+
+async def _primer_resultado_legible(archivos_data: list, nombre_modelo: str) -> dict:
+    """Lanza dos intentos concurrentes y devuelve el primero legible.
+
+    El segundo intento fuerza inferencia nueva (skip_cache): el LLM no es
+    determinista, así que actúa como muestra independiente. La tarea
+    perdedora se cancela.
+    """
+    tareas = [
+        asyncio.create_task(cached_llm(archivos_data, nombre_modelo)),
+        asyncio.create_task(cached_llm(archivos_data, nombre_modelo, skip_cache=True)),
+    ]
+    resultado_llm = None
+    for terminada in asyncio.as_completed(tareas):
+        try:
+            candidato = await terminada
+        except Exception as e:
+            candidato = {"error": str(e), "resultado": None}
+        if candidato.get("resultado") is None:
+            # Fallo duro de este intento: darle la oportunidad al otro
+            resultado_llm = resultado_llm or candidato
+            continue
+        resultado_llm = candidato
+        if not _es_no_legible(candidato):
+            break
+    for tarea in tareas:
+        tarea.cancel()
+    return resultado_llm
+
+async def _procesar_ine_con_reintentos(archivos_data: list, nombre_modelo: str,
+                                       max_intentos: int = 3) -> dict:
+    """Reintenta la determinación del modelo de INE con backoff exponencial.
+
+    El error de imagen no legible suele ser transitorio del LLM; en lugar de
+    un único reintento ciego se hacen hasta max_intentos con espera
+    exponencial y jitter, y se corta en cuanto hay un resultado usable.
+    Si la tasa reciente de "no legible" es alta, el primer intento se hace
+    especulativo (dos llamadas en paralelo, gana la primera legible).
+    """
+    total = _INE_STATS["total"]
+    especular = (total >= _INE_SPEC_MIN_MUESTRA
+                 and _INE_STATS["no_legibles"] / total > _INE_SPEC_UMBRAL)
+    if especular:
+        resultado_llm = await _primer_resultado_legible(archivos_data, nombre_modelo)
+    else:
+        resultado_llm = await cached_llm(archivos_data, nombre_modelo)
+
+    _INE_STATS["total"] += 1
+    if _es_no_legible(resultado_llm):
+        _INE_STATS["no_legibles"] += 1
+
+    for intento in range(1, max_intentos):
+        if not _es_no_legible(resultado_llm):
+            break
+        espera = min(0.5 * (2 ** (intento - 1)), 4) + random.uniform(0, 0.5)
+        logger.info(f"[transform_data] Imagen no legible, reintento {intento}/{max_intentos - 1} en {espera:.1f}s")
+        await asyncio.sleep(espera)
+        resultado_llm = await cached_llm(archivos_data, nombre_modelo, skip_cache=True)
+    return resultado_llm
+
+async def _consultar_listas_negras(apellido: str) -> dict:
+    """Consulta listas negras por apellido usando el cliente httpx compartido."""
+    if not apellido:
+        logger.warning("[transform_data] No se pudo extraer apellido para consulta listas negras")
+        return {"error": "No se pudo extraer apellido del modelo de INE"}
+
+    logger.info(f"[transform_data] Consultando listas negras para apellido: {apellido}")
+    try:
+        client = _get_discovery_client()
+        # Un reintento ante errores de transporte (conexión keep-alive
+        # cerrada por el servidor, reset, etc.); los errores HTTP no se
+        # reintentan porque son deterministas
+        for intento in range(2):
+            try:
+                response = await client.post(
+                    "https://valuacion.aseguradoradigital.com.mx/api/services/app/Consultas/BuscarEnListasNegras",
+                    json={"nombre": f"%{apellido}%"},
+                    headers={"Content-Type": "application/json"},
+                    timeout=30
+                )
+                break
+            except httpx.TransportError:
+                if intento == 1:
+                    raise
+                logger.warning("[transform_data] Error de transporte en listas negras, reintentando...")
+
+        if response.status_code == 200:
+            resultado_listas_negras = response.json()
+            logger.info(f"[transform_data] Resultado listas negras: {resultado_listas_negras}")
+            return resultado_listas_negras
+
+        logger.warning(f"[transform_data] Error en consulta listas negras - Status: {response.status_code}")
+        return {
+            "error": f"Error HTTP {response.status_code}",
+            "status_code": response.status_code
+        }
+    except httpx.TimeoutException:
+        logger.info("[transform_data] Timeout en consulta listas negras")
+        return {"error": "Timeout en consulta listas negras"}
+    except Exception as lista_error:
+        logger.warning(f"[transform_data] Error consultando listas negras: {str(lista_error)}")
+        return {"error": f"Error consultando listas negras: {str(lista_error)}"}
+
 @register("fetch_user")
 async def fetch_user(context: dict, config: dict) -> dict:
     """
@@ -263,8 +707,8 @@ async def fetch_user(context: dict, config: dict) -> dict:
         ]
     }
     """
-    print("XXXXXXXXXXXXXX--Procesando con Modelo Dinámico--XXXXXXXXXXXXXXXXXXXXXXX")
-    print(f"[FETCH_USER - DEBUG] ===== RECIBIDO EN MICROSERVICIO =====")
+    logger.info("XXXXXXXXXXXXXX--Procesando con Modelo Dinámico--XXXXXXXXXXXXXXXXXXXXXXX")
+    logger.debug(f"[FETCH_USER - DEBUG] ===== RECIBIDO EN MICROSERVICIO =====")
     
     
     
@@ -279,7 +723,7 @@ async def fetch_user(context: dict, config: dict) -> dict:
     resultado_servicio_sise = {"resultado": {}, "metadata": {}}
     
     # Obtener execution_id para reportar progreso
-    execution_id = context.get("execution_id") or context.get("dynamic_properties", {}).get("execution_id")
+    execution_id = current_execution_id.get()
     
     # Obtener las propiedades dinámicas del contexto
     dynamic_props = context.get("dynamic_properties", {})
@@ -294,7 +738,7 @@ async def fetch_user(context: dict, config: dict) -> dict:
 
     
     if execution_id:
-        await report_progress(execution_id, "fetch_user", {
+        report_progress_nowait(execution_id, "fetch_user", {
             "percentage": 5,
             "message": "Iniciando procesamiento de documento",
             "current_task": "Validando datos de entrada"
@@ -305,7 +749,7 @@ async def fetch_user(context: dict, config: dict) -> dict:
 
     # Validar que tenemos los datos necesarios
     if not uri_archivo_inicial or not mime_type:
-        print("[FETCH_USER] No se proporcionaron datos de documento, usando datos mock")
+        logger.info("[FETCH_USER] No se proporcionaron datos de documento, usando datos mock")
         user = {
             "id": 1, 
             "url": uri_archivo_inicial,
@@ -315,7 +759,7 @@ async def fetch_user(context: dict, config: dict) -> dict:
         }
     else:
         if execution_id:
-            await report_progress(execution_id, "fetch_user", {
+            report_progress_nowait(execution_id, "fetch_user", {
                 "percentage": 15,
                 "message": "Preparando documento para análisis",
                 "current_task": "Configurando modelo dinámico"
@@ -328,27 +772,34 @@ async def fetch_user(context: dict, config: dict) -> dict:
                 "url": uri_archivo_inicial,
                 "mimetype": mime_type
             }]
-            
+
+            # encuentra_pagina_ine sólo depende de archivos_data: se lanza ya
+            # como tarea para que corra en paralelo con el resto del pipeline
+            # (extracción, reordenado, marcado, subida) y se espera al final
+            pagina_ine_task = asyncio.create_task(
+                cached_llm(archivos_data, "encuentra_pagina_ine", skip_cache=manual)
+            )
+
             # Obtener nombre del modelo desde config o usar por defecto
             nombre_modelo = config.get("modelo", "modelo_por_defecto")
             
-            print(f"[FETCH_USER] Procesando documento con modelo dinámico: {nombre_modelo}")
+            logger.info(f"[FETCH_USER] Procesando documento con modelo dinámico: {nombre_modelo}")
             
             if execution_id:
-                await report_progress(execution_id, "fetch_user", {
+                report_progress_nowait(execution_id, "fetch_user", {
                     "percentage": 30,
                     "message": f"Procesando con modelo {nombre_modelo}",
                     "current_task": "Ejecutando análisis de LLM"
                 })
             
             # Procesar con modelo dinámico (obtiene modelo desde BD)
-            resultado_llm = await procesar_con_modelo_dinamico_desde_bd(archivos_data, nombre_modelo)
+            resultado_llm = await cached_llm(archivos_data, nombre_modelo, skip_cache=manual)
 
 
-            resultado_servicio_sise = await procesar_con_modelo_dinamico_desde_bd(archivos_data, "dataSise")
+            resultado_servicio_sise = await cached_llm(archivos_data, "dataSise", skip_cache=manual)
 
             if execution_id:
-                await report_progress(execution_id, "fetch_user", {
+                report_progress_nowait(execution_id, "fetch_user", {
                     "percentage": 60,
                     "message": "Reordenando secciones del PDF",
                     "current_task": "Organizando documento"
@@ -358,59 +809,36 @@ async def fetch_user(context: dict, config: dict) -> dict:
             
             
             ##Determino si el expediente esta completo o no
-            
-            # Diccionario para mostrar nombres más amigables
-            nombres_documentos = {
-                "csf": "Constancia de Situación Fiscal",
-                "fcc": "Formulario de Cumplimiento de Cliente",
-                "ine": "INE",
-                "rpp": "Registro Público de la Propiedad",
-                "constancia_fea": "Constancia de Firma Electrónica Avanzada",
-                "poder_notarial": "Poder Notarial",
-                "acta_constitutiva": "Acta Constitutiva",
-                "comprobante_domicilio": "Comprobante de Domicilio"
-            }
 
-            # Detectar documentos faltantes
+            # Detectar documentos faltantes (una sola pasada sobre el resultado)
             faltantes = [
-                nombres_documentos[doc]
+                _NOMBRES_DOCUMENTOS[doc]
                 for doc, datos in resultado_llm["resultado"].items()
                 if not datos["presente"]
             ]
 
             # Variable booleana
-            expedienteConCargaCompleta = len(faltantes) == 0
+            expedienteConCargaCompleta = not faltantes
 
             # Variable texto
             if expedienteConCargaCompleta:
                 expedienteCompleto = "El expediente está completo"
             else:
-                expedienteCompleto = "Faltan los documentos: " + ", ".join(faltantes)
+                expedienteCompleto = f"Faltan los documentos: {', '.join(faltantes)}"
 
-            print("expedienteCompleto:", expedienteCompleto)
-            print("expedienteConCargaCompleta:", expedienteConCargaCompleta)
+            logger.info("expedienteCompleto: %s", expedienteCompleto)
+            logger.info("expedienteConCargaCompleta: %s", expedienteConCargaCompleta)
             
             
             
             
-            orden_objetivo = [
-                "fcc",
-                "csf",
-                "constancia_fea",
-                "comprobante_domicilio",
-                "ine",
-                "poder_notarial",
-                "acta_constitutiva",
-                "rpp",
-            ]
-            
-            # Inicializar el manager de GCS para pasarlo a la función de reordenamiento
-            gcs_manager = GCSFileManager()
-            
-            
+            # Reusar el manager de GCS para pasarlo a la función de reordenamiento
+            gcs_manager = _gcs()
+
+
             res = reorder_pdf_sections(
                 secciones=resultado_llm["resultado"],
-                orden=orden_objetivo,
+                orden=list(_ORDEN_OBJETIVO),
                 pdf_gcs_uri=uri_archivo_inicial,
                 return_b64=True,
                 upload_sections_to_gcs=True,
@@ -419,14 +847,16 @@ async def fetch_user(context: dict, config: dict) -> dict:
             )
 
             if execution_id:
-                await report_progress(execution_id, "fetch_user", {
+                report_progress_nowait(execution_id, "fetch_user", {
                     "percentage": 85,
                     "message": "Subiendo archivos a GCS",
                     "current_task": "Almacenando resultados"
                 })
 
             #necesito subir el archivo pdf al bucket de GCP, se obtiene del res que sera un base64
-            pdf_b64 = res.get("out_b64", "")
+            # pop: res sigue vivo hasta el final del step y retener ahí el
+            # base64 (~1.33x el PDF) duplicaría la residencia en memoria
+            pdf_b64 = res.pop("out_b64", "") if res else ""
             pdf_filename = None
             pdf_size_kb = 0
             gcs_uri = None
@@ -437,114 +867,64 @@ async def fetch_user(context: dict, config: dict) -> dict:
             
             if res:
                 try:
-                    # Crear nombre de archivo único para subir al bucket
-                    timestamp = int(time.time())
+                    # Crear nombre de archivo único para subir al bucket;
+                    # uuid4 en lugar de int(time.time()): dos requests en el
+                    # mismo segundo colisionaban y se sobreescribían en GCS
+                    sufijo_unico = uuid.uuid4().hex[:16]
                     
                     # PASO 1: Marcar el PDF con validación ANTES de subirlo a GCS
-                    print(f"[FETCH_USER] Marcando PDF con validación antes de subir a GCS...")
-                    
-                    # Importar las dependencias necesarias
-                    import tempfile
-                    import os
+                    logger.info(f"[FETCH_USER] Marcando PDF con validación antes de subir a GCS...")
                     
-                    # Variables para manejar el PDF final
-                    pdf_b64_final = pdf_b64
-                    pdf_bytes_final = base64.b64decode(pdf_b64)
-                    pdf_filename = f"documento_reordenado_{timestamp}.pdf"
-                    
-                    try:
-                        # Importar la funcionalidad de marcado
-                        from app.utils.marcarPDF import MarcadorPDF
-                        
-                        # Crear instancia del marcador
-                        marcador = MarcadorPDF(bucket_name="perdidas-totales-pruebas")
-                        
-                        # Crear archivo temporal para el PDF original
-                        with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as temp_original:
-                            temp_original.write(pdf_bytes_final)
-                            temp_original_path = temp_original.name
-                        
-                        # Crear archivo temporal para el PDF marcado
-                        with tempfile.NamedTemporaryFile(delete=False, suffix='_marcado.pdf') as temp_marcado:
-                            temp_marcado_path = temp_marcado.name
-                        
-                        try:
-                            # Marcar el PDF localmente
-                            resultado_marcado = marcador.marcar_pdf_local(
-                                input_path=temp_original_path,
-                                output_path=temp_marcado_path
-                            )
-                            
-                            if resultado_marcado["success"]:
-                                print(f"[FETCH_USER] ✓ PDF marcado exitosamente con: {resultado_marcado['marca_aplicada']}")
-                                
-                                # Leer el PDF marcado y convertirlo a base64
-                                with open(temp_marcado_path, 'rb') as marcado_file:
-                                    pdf_marcado_bytes = marcado_file.read()
-                                    pdf_marcado_b64 = base64.b64encode(pdf_marcado_bytes).decode('utf-8')
-                                    
-                                # Usar el PDF marcado en lugar del original
-                                pdf_b64_final = pdf_marcado_b64
-                                pdf_bytes_final = pdf_marcado_bytes
-                                pdf_filename = f"documento_reordenado_marcado_{timestamp}.pdf"
-                                
-                                print(f"[FETCH_USER] ✓ Usando PDF marcado para subir a GCS (tamaño: {len(pdf_bytes_final)/1024:.1f} KB)")
-                                
-                            else:
-                                print(f"[FETCH_USER] ⚠ Error marcando PDF: {resultado_marcado.get('error', 'Error desconocido')}")
-                                print(f"[FETCH_USER] → Continuando con PDF original sin marca")
-                                
-                        except Exception as marcado_inner_error:
-                            print(f"[FETCH_USER] ⚠ Excepción durante marcado: {str(marcado_inner_error)}")
-                            print(f"[FETCH_USER] → Continuando con PDF original sin marca")
-                            
-                        finally:
-                            # Limpiar archivos temporales
-                            try:
-                                if os.path.exists(temp_original_path):
-                                    os.unlink(temp_original_path)
-                                if os.path.exists(temp_marcado_path):
-                                    os.unlink(temp_marcado_path)
-                            except Exception as cleanup_error:
-                                print(f"[FETCH_USER] Advertencia limpiando archivos temporales: {cleanup_error}")
-                                
-                    except ImportError as import_error:
-                        print(f"[FETCH_USER] ⚠ Error importando MarcadorPDF: {import_error}")
-                        print(f"[FETCH_USER] → Continuando con PDF original sin marca")
-                    except Exception as marcado_error:
-                        print(f"[FETCH_USER] ⚠ Error general en marcado: {str(marcado_error)}")
-                        print(f"[FETCH_USER] → Continuando con PDF original sin marca")
+                    # Variables para manejar el PDF final: decodificar el
+                    # base64 una sola vez y trabajar con bytes de aquí en
+                    # adelante (la subida acepta bytes directamente). Tanto el
+                    # decode de un PDF grande (CPU puro) como el marcado
+                    # (pypdf + disco) bloquean, así que corren en hilos
+                    pdf_bytes_final = await asyncio.to_thread(_b64_to_bytes, pdf_b64)
+                    pdf_b64 = None  # liberar el string base64: ya nadie lo usa
+                    pdf_filename = f"documento_reordenado_{sufijo_unico}.pdf"
+
+                    pdf_bytes_marcado = await asyncio.to_thread(_marcar_pdf_validacion, pdf_bytes_final)
+                    if pdf_bytes_marcado is not None:
+                        pdf_bytes_final = pdf_bytes_marcado
+                        pdf_filename = f"documento_reordenado_marcado_{sufijo_unico}.pdf"
+                        logger.info(f"[FETCH_USER] ✓ Usando PDF marcado para subir a GCS (tamaño: {len(pdf_bytes_final)/1024:.1f} KB)")
                     
                     # PASO 2: Subir el PDF (marcado o original) a GCS
-                    print(f"[FETCH_USER] Subiendo PDF a GCS...")
+                    logger.info(f"[FETCH_USER] Subiendo PDF a GCS...")
                     
                     # Calcular tamaño del PDF final
                     pdf_size_kb = round(len(pdf_bytes_final) / 1024, 2)
                     
-                    # Inicializar el manager de GCS y subir el archivo
-                    gcs_manager = GCSFileManager()
+                    # Reusar el manager de GCS y subir el archivo
+                    gcs_manager = _gcs()
                     
                     # Crear estructura de carpetas: procesos/{uuid_proceso}/
                     folder_path = f"procesos/{uuid_proceso}"
                     
-                    gcs_upload_result = gcs_manager.upload_file_to_folder(
-                        base64_content=pdf_b64_final,
-                        mime_type="application/pdf",
-                        filename=pdf_filename,
-                        folder=folder_path,
-                        include_signed_url=True,  # Incluir URL firmada
-                        signed_url_expiration_hours=24  # Válida por 24 horas
-                    )
+                    # La subida es I/O bloqueante del SDK de GCS: se despacha a un
+                    # hilo para no congelar el event loop durante archivos grandes
+                    async with GCS_SEM:
+                        gcs_upload_result = await asyncio.to_thread(
+                            gcs_manager.upload_bytes_to_folder,
+                            data=pdf_bytes_final,
+                            mime_type="application/pdf",
+                            filename=pdf_filename,
+                            folder=folder_path,
+                            include_signed_url=True,  # Incluir URL firmada
+                            signed_url_expiration_hours=24  # Válida por 24 horas
+                        )
                     
                     gcs_uri = gcs_upload_result.get("uri", "")
                     gcs_signed_url = gcs_upload_result.get("signed_url", "")
                     
-                    print(f"[FETCH_USER] PDF reordenado subido a GCS: {gcs_uri} ({pdf_size_kb} KB)")
+                    logger.info(f"[FETCH_USER] PDF reordenado subido a GCS: {gcs_uri} ({pdf_size_kb} KB)")
                     if gcs_signed_url:
-                        print(f"[FETCH_USER] URL firmada generada: {gcs_signed_url[:100]}...")  # Solo mostrar primeros 100 caracteres
+                        # Lazy: el slice de 100 caracteres sólo se evalúa si DEBUG está activo
+                        logger.debug("[FETCH_USER] URL firmada generada: %.100s...", gcs_signed_url)
                     
                 except Exception as e:
-                    print(f"[FETCH_USER] Error subiendo PDF a GCS: {str(e)}")
+                    logger.warning(f"[FETCH_USER] Error subiendo PDF a GCS: {str(e)}")
                     pdf_filename = None
                     pdf_size_kb = 0
                     gcs_uri = None
@@ -591,14 +971,14 @@ async def fetch_user(context: dict, config: dict) -> dict:
             }
             
             if execution_id:
-                await report_progress(execution_id, "fetch_user", {
+                report_progress_nowait(execution_id, "fetch_user", {
                     "percentage": 100,
                     "message": "Documento procesado exitosamente",
                     "current_task": "Finalizando"
                 })
             
         except Exception as e:
-            print(f"[FETCH_USER] Error procesando documento: {str(e)}")
+            logger.warning(f"[FETCH_USER] Error procesando documento: {str(e)}")
             resultado_llm = {"resultado": {}, "metadata": {"error": str(e)}}
             user = {
                 "id": 1,
@@ -610,25 +990,37 @@ async def fetch_user(context: dict, config: dict) -> dict:
     
     ################################## NO BORRAR ###############################################
     
+    # user queda asignado en todas las ramas de arriba; hoistear los
+    # sub-dicts evita re-caminar los mismos .get() anidados en cada línea
+    # del return (y las decenas de dicts vacíos temporales)
+    pdf_r = user.get("pdf_reordenado") or {}
+    secs = user.get("secciones_individuales") or {}
+    anot = user.get("pdf_anotado") or {}
+
     archivos_completo = [{
                 "nombre": "archivo.pdf",
-                "url": user.get("pdf_reordenado", {}).get("gcs_uri", "") if 'user' in locals() else "",
+                "url": pdf_r.get("gcs_uri", ""),
                 "mimetype": "application/pdf"
             }]
             
     
-    resultado_pagina_ine = await procesar_con_modelo_dinamico_desde_bd(archivos_data, "encuentra_pagina_ine")
-    
-    # Reportar completado si tenemos execution_id
+    # Reportar completado si tenemos execution_id; se despacha como tarea
+    # ANTES de la última llamada al modelo para que el POST a Discovery viaje
+    # en paralelo con la inferencia (no dependen entre sí)
     if execution_id:
-        await report_completion(execution_id, "fetch_user", {
+        _sections_found = len(user.get("resultado_llm") or ())
+        tarea_completado = asyncio.create_task(report_completion(execution_id, "fetch_user", {
             "success": user.get("status") == "procesado",
             "document_processed": True,
-            "sections_found": len(user.get("resultado_llm", {})) if 'user' in locals() else 0,
-            "pdf_uploaded": user.get("pdf_reordenado", {}).get("subido_a_gcs", False) if 'user' in locals() else False
-        })
+            "sections_found": _sections_found,
+            "pdf_uploaded": pdf_r.get("subido_a_gcs", False)
+        }))
+        _PENDING_REPORTS.add(tarea_completado)
+        tarea_completado.add_done_callback(_PENDING_REPORTS.discard)
+
+    resultado_pagina_ine = await pagina_ine_task
     
-    print("XXXXXXXXXXXXXX--Procesamiento completado--XXXXXXXXXXXXXXXXXXXXXXX")
+    logger.info("XXXXXXXXXXXXXX--Procesamiento completado--XXXXXXXXXXXXXXXXXXXXXXX")
     
     return {
         "context": {
@@ -642,24 +1034,24 @@ async def fetch_user(context: dict, config: dict) -> dict:
                 "uuid_proceso": uuid_proceso,
                 "execution_id": execution_id,  # También en dynamic_properties
                 "estructura_carpetas": f"procesos/{uuid_proceso}",
-                "pdf_reordenado_disponible": user.get("pdf_reordenado", {}).get("disponible", False) if 'user' in locals() else False,
-                "pdf_reordenado_archivo": user.get("pdf_reordenado", {}).get("nombre_archivo") if 'user' in locals() else None,
-                "pdf_reordenado_gcs_uri": user.get("pdf_reordenado", {}).get("gcs_uri", "") if 'user' in locals() else "",
-                "pdf_reordenado_gcs_signed_url": user.get("pdf_reordenado", {}).get("gcs_signed_url", "") if 'user' in locals() else "",
-                "pdf_reordenado_gcs_object_id": user.get("pdf_reordenado", {}).get("gcs_object_id") if 'user' in locals() else None,
-                "pdf_reordenado_subido_gcs": user.get("pdf_reordenado", {}).get("subido_a_gcs", False) if 'user' in locals() else False,
-                "pdf_reordenado_tamaño_kb": user.get("pdf_reordenado", {}).get("tamaño_kb", 0) if 'user' in locals() else 0,
-                "secciones_individuales_disponibles": user.get("secciones_individuales", {}).get("disponibles", False) if 'user' in locals() else False,
-                "secciones_individuales_subidas": user.get("secciones_individuales", {}).get("total_subidas", 0) if 'user' in locals() else 0,
-                "secciones_individuales_uris": user.get("secciones_individuales", {}).get("uris", {}) if 'user' in locals() else {},
+                "pdf_reordenado_disponible": pdf_r.get("disponible", False),
+                "pdf_reordenado_archivo": pdf_r.get("nombre_archivo"),
+                "pdf_reordenado_gcs_uri": pdf_r.get("gcs_uri", ""),
+                "pdf_reordenado_gcs_signed_url": pdf_r.get("gcs_signed_url", ""),
+                "pdf_reordenado_gcs_object_id": pdf_r.get("gcs_object_id"),
+                "pdf_reordenado_subido_gcs": pdf_r.get("subido_a_gcs", False),
+                "pdf_reordenado_tamaño_kb": pdf_r.get("tamaño_kb", 0),
+                "secciones_individuales_disponibles": secs.get("disponibles", False),
+                "secciones_individuales_subidas": secs.get("total_subidas", 0),
+                "secciones_individuales_uris": secs.get("uris", {}),
                 "resultado_llm_ordena_pdf": resultado_llm["resultado"],
                 "metadata_llm_ordena_pdf": resultado_llm["metadata"],
                 # Nuevas propiedades para PDF anotado con GEMINIS
-                "pdf_anotado_disponible": user.get("pdf_anotado", {}).get("disponible", False) if 'user' in locals() else False,
-                "pdf_anotado_gcs_uri": user.get("pdf_anotado", {}).get("gcs_uri", "") if 'user' in locals() else "",
-                "pdf_anotado_tiempo_procesamiento": user.get("pdf_anotado", {}).get("tiempo_anotacion_segundos", 0) if 'user' in locals() else 0,
-                "pdf_anotado_valores_encontrados": len(user.get("pdf_anotado", {}).get("valores_anotados", [])) if 'user' in locals() else 0,
-                "pdf_anotado_resumen": user.get("pdf_anotado", {}).get("resumen_anotaciones", {}) if 'user' in locals() else {},
+                "pdf_anotado_disponible": anot.get("disponible", False),
+                "pdf_anotado_gcs_uri": anot.get("gcs_uri", ""),
+                "pdf_anotado_tiempo_procesamiento": anot.get("tiempo_anotacion_segundos", 0),
+                "pdf_anotado_valores_encontrados": len(anot.get("valores_anotados", [])),
+                "pdf_anotado_resumen": anot.get("resumen_anotaciones", {}),
                 "expedienteCompleto": expedienteCompleto,
                 "expedienteConCargaCompleta": expedienteConCargaCompleta,
                 "paginaIneApoderado": resultado_pagina_ine["resultado"],
@@ -679,10 +1071,10 @@ async def validate_user(context: dict, config: dict) -> dict:
     Ahora vamos a hacer ocr al documento y obtner los datos necesarios para pintar el documento
     """
     # Obtener execution_id para reportar progreso
-    execution_id = context.get("execution_id") or context.get("dynamic_properties", {}).get("execution_id")
+    execution_id = current_execution_id.get()
     
     if execution_id:
-        await report_progress(execution_id, "validate_user", {
+        report_progress_nowait(execution_id, "validate_user", {
             "percentage": 10,
             "message": "Iniciando validación de documento",
             "current_task": "Preparando datos para OCR"
@@ -695,7 +1087,7 @@ async def validate_user(context: dict, config: dict) -> dict:
     nombre_documento = dynamic_props.get("nombre_documento") or context.get("nombre_documento", "")
 
     if execution_id:
-        await report_progress(execution_id, "validate_user", {
+        report_progress_nowait(execution_id, "validate_user", {
             "percentage": 25,
             "message": "Procesando documento con modelo de extracción",
             "current_task": "Ejecutando OCR y extracción de datos"
@@ -710,42 +1102,41 @@ async def validate_user(context: dict, config: dict) -> dict:
         nombre_modelo = "extrae_data_492"
         
         if execution_id:
-            await report_progress(execution_id, "validate_user", {
+            report_progress_nowait(execution_id, "validate_user", {
                 "percentage": 50,
                 "message": f"Procesando con modelo {nombre_modelo}",
                 "current_task": "Extrayendo datos del documento"
             })
         
-        resultado_llm = await procesar_con_modelo_dinamico_desde_bd(archivos_data, nombre_modelo)
+        resultado_llm = await cached_llm(archivos_data, nombre_modelo)
         
 
         if execution_id:
-            await report_progress(execution_id, "validate_user", {
+            report_progress_nowait(execution_id, "validate_user", {
                 "percentage": 80,
                 "message": "Procesamiento completado",
                 "current_task": "Preparando respuesta"
             })
             
     except Exception as e:
-        print(f"[validate_user] Error procesando documento: {e}")
+        logger.warning(f"[validate_user] Error procesando documento: {e}")
         resultado_llm = {"error": str(e), "resultado": None}
 
     # === PRESERVAR CONTEXTO Y SOLO ANEXAR TU CAMPO ===
-    new_context = deepcopy(context)  # opcional; evita mutar el original
-
-    # Asegura el dict de dynamic_properties
-    prev_dp = new_context.get("dynamic_properties", {}) or {}
-    new_context["dynamic_properties"] = {
-        **prev_dp,
-        "resultado_llm_extraccion_data": resultado_llm.get("resultado")
-    }
-
-    # Campos de validación (booleans, no strings)
-    new_context.update({
+    # Copia superficial + merge explícito de dynamic_properties: deepcopy
+    # recorría todo el árbol del resultado LLM (miles de nodos) sólo para
+    # anexar un par de claves de primer nivel
+    new_context = {
+        **context,
+        "dynamic_properties": {
+            **(context.get("dynamic_properties") or {}),
+            "resultado_llm_extraccion_data": resultado_llm.get("resultado")
+        },
+        # Campos de validación (booleans, no strings)
         "valid": True,
         "validation_reason": "",
-        "validated_at": datetime.now(timezone.utc).isoformat(timespec="seconds").replace("+00:00", "Z")
-    })
+        "validated_at": _ts_z()
+    }
 
     is_valid = new_context["valid"]
     
@@ -769,21 +1160,21 @@ async def transform_data(context: dict, config: dict) -> dict:
     Determinamos el modelo de la ine y hacemos la busqueda en la pagina del ine
     """
     # Obtener execution_id para reportar progreso
-    execution_id = context.get("execution_id") or context.get("dynamic_properties", {}).get("execution_id")
+    execution_id = current_execution_id.get()
     
     data = context.get("dynamic_properties", {})
     # print(data)
     
     documents = data["resultado_llm_extraccion_data"]["documents"]
 
-    print("documentos----------------------------")
-    print(documents)
+    logger.info("documentos----------------------------")
+    logger.debug("%s", documents)
 
     # Buscar el documento deseado
     valor = None
     for doc in documents:
         if doc["name"] == "Formato conoce a tu cliente PERSONA MORAL MEXICANA":
-            print("encontrado!!!")
+            logger.info("encontrado!!!")
             
             # Estrategia 1: Búsqueda exacta
             valor = doc["fields"].get("NOMBRE_DEL_ADMINISTRADOR_UNICO_DIRECTOR_GENERAL_APODERADO")
@@ -798,7 +1189,7 @@ async def transform_data(context: dict, config: dict) -> dict:
                     if any(keyword in field_name.upper() for keyword in keywords):
                         # Además verificar que contenga "NOMBRE" para ser más específico
                         if "NOMBRE" in field_name.upper():
-                            print(f"Campo encontrado por similitud: {field_name}")
+                            logger.info(f"Campo encontrado por similitud: {field_name}")
                             valor = field_value
                             break
             
@@ -819,7 +1210,7 @@ async def transform_data(context: dict, config: dict) -> dict:
                 )
                 
                 if valor:
-                    print(f"Campo encontrado por búsqueda difusa: {field_name} (similitud: {similarity:.2f})")
+                    logger.info(f"Campo encontrado por búsqueda difusa: {field_name} (similitud: {similarity:.2f})")
             
             # Estrategia 4: Si aún no encuentra, buscar cualquier campo que contenga "NOMBRE" y tenga formato de nombre completo
             if valor is None:
@@ -828,19 +1219,19 @@ async def transform_data(context: dict, config: dict) -> dict:
                         field_value and 
                         isinstance(field_value, str) and
                         "," in field_value):  # Formato: Apellidos, Nombres
-                        print(f"Campo encontrado por formato de nombre: {field_name}")
+                        logger.info(f"Campo encontrado por formato de nombre: {field_name}")
                         valor = field_value
                         break
                         
-            print(f"Valor extraído: {valor}")
+            logger.info(f"Valor extraído: {valor}")
             break
 
-    print("aqui va el valor$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$")
-    print(valor)
+    logger.info("aqui va el valor$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$")
+    logger.debug("%s", valor)
     
     # Verificar que el valor no sea None antes de procesarlo
     if valor is None:
-        print("ERROR: No se pudo extraer el nombre del administrador")
+        logger.warning("ERROR: No se pudo extraer el nombre del administrador")
         apellidos = "sin_datos"
         nombres = "sin_datos"
     else:
@@ -851,66 +1242,17 @@ async def transform_data(context: dict, config: dict) -> dict:
         apellidos = partes[0].strip().lower()
         nombres = partes[1].strip().lower() if len(partes) > 1 else "sin_nombres"
 
-    print("apellidos =", apellidos)
-    print("nombres =", nombres)
+    logger.info("apellidos = %s", apellidos)
+    logger.info("nombres = %s", nombres)
     
     # Ejecutar búsqueda de antecedentes
     redesSociales = await screen_person(valor, location="México", topk=5)
     
     
-            # Consultar listas negras con el apellido extraído del modelo de INE (independiente de la validación de INE)
-    try:
-        # apellido = resultado_llm.get("resultado", {}).get("apellido", "")
-        # apellido = "Guzman"
-        # apellido = "Joaquin Archivaldo"
-        # apellido = "Guzman Loera"
-        apellido = apellidos
-            
-        if apellido:
-            print(f"[transform_data] Consultando listas negras para apellido: {apellido}")
-                
-            # if execution_id:
-            #     await report_progress(execution_id, "transform_data", {
-            #         "percentage": 75,
-            #         "message": "Consultando listas negras",
-            #         "current_task": f"Verificando apellido {apellido}"
-            #     })
-                
-            try:
-                async with httpx.AsyncClient(timeout=30) as client:
-                    response = await client.post(
-                        "https://valuacion.aseguradoradigital.com.mx/api/services/app/Consultas/BuscarEnListasNegras",
-                        json={"nombre": f"%{apellido}%"},
-                        headers={"Content-Type": "application/json"}
-                    )
-                        
-                    if response.status_code == 200:
-                        resultado_listas_negras = response.json()
-                        print(f"[transform_data] Resultado listas negras: {resultado_listas_negras}")
-                    else:
-                        print(f"[transform_data] Error en consulta listas negras - Status: {response.status_code}")
-                        resultado_listas_negras = {
-                            "error": f"Error HTTP {response.status_code}",
-                            "status_code": response.status_code
-                        }
-                            
-            except httpx.TimeoutException:
-                print(f"[transform_data] Timeout en consulta listas negras")
-                resultado_listas_negras = {"error": "Timeout en consulta listas negras"}
-            except Exception as lista_error:
-                print(f"[transform_data] Error consultando listas negras: {str(lista_error)}")
-                resultado_listas_negras = {"error": f"Error consultando listas negras: {str(lista_error)}"}
-        else:
-            print(f"[transform_data] No se pudo extraer apellido para consulta listas negras")
-            resultado_listas_negras = {"error": "No se pudo extraer apellido del modelo de INE"}
-                
-    except Exception as listas_negras_error:
-        print(f"[transform_data] Error general en consulta listas negras: {str(listas_negras_error)}")
-        resultado_listas_negras = {"error": f"Error general en consulta listas negras: {str(listas_negras_error)}"}
     
     
     if execution_id:
-        await report_progress(execution_id, "transform_data", {
+        report_progress_nowait(execution_id, "transform_data", {
             "percentage": 10,
             "message": "Iniciando transformación de datos",
             "current_task": "Preparando archivos para análisis"
@@ -924,8 +1266,32 @@ async def transform_data(context: dict, config: dict) -> dict:
     ine_uri = dynamic_props.get("secciones_individuales_uris", {}).get("ine", {}).get("uri") if dynamic_props.get("secciones_individuales_uris") else None
     nombre_documento = dynamic_props.get("nombre_documento") or context.get("nombre_documento", "")
 
+    # Sin las URIs de INE y FCC el LLM sólo puede devolver error (y el
+    # reintento dispararía una segunda llamada igual de inútil): se corta
+    # aquí y se manda directo a rechazo con la razón explícita
+    if not ine_uri or not fcc_uri:
+        faltantes = [nombre for nombre, uri in (("ine", ine_uri), ("fcc", fcc_uri)) if not uri]
+        validation_reason = f"Faltan URIs de secciones requeridas: {', '.join(faltantes)}"
+        logger.info(f"[transform_data] {validation_reason}")
+
+        if execution_id:
+            await report_completion(execution_id, "transform_data", {
+                "success": False,
+                "error": validation_reason,
+                "ine_model_determined": False,
+                "ine_validation_completed": False
+            })
+
+        return {
+            "dp_updates": {
+                "validation_reason": validation_reason,
+                "secciones_faltantes": faltantes
+            },
+            "next": "reject_user"
+        }
+
     if execution_id:
-        await report_progress(execution_id, "transform_data", {
+        report_progress_nowait(execution_id, "transform_data", {
             "percentage": 25,
             "message": "Analizando documentos INE y FCC",
             "current_task": "Determinando modelo de INE"
@@ -948,58 +1314,55 @@ async def transform_data(context: dict, config: dict) -> dict:
         nombre_modelo = "determina_modelo_ine"
         
         if execution_id:
-            await report_progress(execution_id, "transform_data", {
+            report_progress_nowait(execution_id, "transform_data", {
                 "percentage": 50,
                 "message": f"Procesando con modelo {nombre_modelo}",
                 "current_task": "Determinando tipo de INE"
             })
         
-        resultado_llm = await procesar_con_modelo_dinamico_desde_bd(archivos_data, nombre_modelo)
-        
-        if(resultado_llm.get("resultado").get("error") == "La imagen no es legible o no corresponde a una credencial para votar válida."):
-            #Necesito volver a procesar el documento
-            resultado_llm = await procesar_con_modelo_dinamico_desde_bd(archivos_data, nombre_modelo)
+        resultado_llm = await _procesar_ine_con_reintentos(archivos_data, nombre_modelo)
 
         # Ahora validar la INE con los datos extraídos
         if execution_id:
-            await report_progress(execution_id, "transform_data", {
+            report_progress_nowait(execution_id, "transform_data", {
                 "percentage": 70,
                 "message": "Validando INE en línea",
                 "current_task": "Consultando base de datos del INE"
             })
         
-        print(f"[transform_data] Iniciando validación de INE...")
-        
-        # Inicializar resultado_listas_negras para evitar errores de variable no definida
-        # resultado_listas_negras = None
-        
-        try:
-            # Llamar a la función de validación de INE con el uuid_proceso
-            uuid_proceso = dynamic_props.get("uuid_proceso", "uuid_default")
-            resultado_validacion_ine = validar_ine_con_modelo_identificado(
-                resultado_llm.get("resultado", {}), 
+        logger.info(f"[transform_data] Iniciando validación de INE...")
+
+        # La validación de INE (sync, va al thread pool) y la consulta de
+        # listas negras son independientes: en paralelo esta fase cuesta
+        # max(t_ine, t_listas) en lugar de la suma
+        uuid_proceso = dynamic_props.get("uuid_proceso", "uuid_default")
+        resultado_validacion_ine, resultado_listas_negras = await asyncio.gather(
+            asyncio.to_thread(
+                validar_ine_con_modelo_identificado,
+                resultado_llm.get("resultado", {}),
                 uuid_proceso=uuid_proceso
-            )
-            print(f"[transform_data] Resultado validación INE: {resultado_validacion_ine.get('validacion_exitosa', False)}")
-        except Exception as validacion_error:
-            print(f"[transform_data] Error en validación INE: {str(validacion_error)}")
-            
-            try:
-                resultado_validacion_ine = validar_ine_con_modelo_identificado(
-                    resultado_llm.get("resultado", {}),
-                    uuid_proceso=uuid_proceso
-                )
-            except Exception as validacion_error:
-                print(f"[transform_data] Error en validación INE: {str(validacion_error)}")
+            ),
+            _consultar_listas_negras_dedup(apellidos),
+            return_exceptions=True
+        )
 
+        if isinstance(resultado_validacion_ine, Exception):
+            logger.warning(f"[transform_data] Error en validación INE: {str(resultado_validacion_ine)}")
             resultado_validacion_ine = {
-                "error": f"Error en validación INE: {str(validacion_error)}",
+                "error": f"Error en validación INE: {str(resultado_validacion_ine)}",
                 "validacion_exitosa": False
             }
+        else:
+            logger.info(f"[transform_data] Resultado validación INE: {resultado_validacion_ine.get('validacion_exitosa', False)}")
+
+        if isinstance(resultado_listas_negras, Exception):
+            resultado_listas_negras = {
+                "error": f"Error consultando listas negras: {str(resultado_listas_negras)}"
+            }
         
 
     except Exception as e:
-        print(f"[transform_data] Error procesando documento: {e}")
+        logger.warning(f"[transform_data] Error procesando documento: {e}")
         resultado_llm = {"error": str(e), "resultado": None}
         resultado_validacion_ine = {
             "error": "No se pudo validar INE por error en procesamiento previo",
@@ -1010,7 +1373,7 @@ async def transform_data(context: dict, config: dict) -> dict:
         }
 
     if execution_id:
-        await report_progress(execution_id, "transform_data", {
+        report_progress_nowait(execution_id, "transform_data", {
             "percentage": 90,
             "message": "Finalizando transformación",
             "current_task": "Preparando resultados"
@@ -1022,10 +1385,10 @@ async def transform_data(context: dict, config: dict) -> dict:
     pdfFirmada = context.get("dynamic_properties", {}).get("pdf_reordenado_gcs_signed_url") or context.get("pdf_reordenado_gcs_signed_url")
     
     # Debug: verificar que tenemos los datos necesarios
-    print(f"[transform_data] DEBUG - paginaIne: {paginaIne}")
-    print(f"[transform_data] DEBUG - pdfUri: {pdfUri}")
-    print(f"[transform_data] DEBUG - pdfFirmada: {pdfFirmada}")
-    print(f"[transform_data] DEBUG - resultado_validacion_ine keys: {list(resultado_validacion_ine.keys()) if isinstance(resultado_validacion_ine, dict) else 'No es dict'}")
+    logger.debug(f"[transform_data] DEBUG - paginaIne: {paginaIne}")
+    logger.debug(f"[transform_data] DEBUG - pdfUri: {pdfUri}")
+    logger.debug(f"[transform_data] DEBUG - pdfFirmada: {pdfFirmada}")
+    logger.debug(f"[transform_data] DEBUG - resultado_validacion_ine keys: {list(resultado_validacion_ine.keys()) if isinstance(resultado_validacion_ine, dict) else 'No es dict'}")
     
     # Implementar concatenación de PDF con imagen
     concatenacion_resultado = {
@@ -1044,9 +1407,9 @@ async def transform_data(context: dict, config: dict) -> dict:
         if not imagen_uri:
             # Imagen de validación por defecto como fallback
             imagen_uri = "gs://perdidas-totales-pruebas/imagenes/sello_validacion.png"
-            print(f"[transform_data] No se encontró evidencia INE, usando imagen por defecto: {imagen_uri}")
+            logger.info(f"[transform_data] No se encontró evidencia INE, usando imagen por defecto: {imagen_uri}")
         else:
-            print(f"[transform_data] Usando imagen de evidencia INE: {imagen_uri}")
+            logger.info(f"[transform_data] Usando imagen de evidencia INE: {imagen_uri}")
         
         # Solo proceder si tenemos todos los datos necesarios
         if pdfUri and imagen_uri and paginaIne:
@@ -1055,10 +1418,10 @@ async def transform_data(context: dict, config: dict) -> dict:
             # Validar parámetros antes de procesar
             validar_parametros(pdfUri, imagen_uri, paginaIne)
             
-            print(f"[transform_data] Insertando imagen en página {paginaIne} del PDF...")
+            logger.info(f"[transform_data] Insertando imagen en página {paginaIne} del PDF...")
             
             if execution_id:
-                await report_progress(execution_id, "transform_data", {
+                report_progress_nowait(execution_id, "transform_data", {
                     "percentage": 85,
                     "message": "Insertando imagen de validación en PDF",
                     "current_task": f"Agregando imagen en página {paginaIne}"
@@ -1075,9 +1438,9 @@ async def transform_data(context: dict, config: dict) -> dict:
             pdfUri = nueva_uri
             pdfFirmada = url_firmada
             
-            print(f"[transform_data] ✓ PDF concatenado exitosamente:")
-            print(f"[transform_data] → Nueva URI: {nueva_uri}")
-            print(f"[transform_data] → URL firmada: {url_firmada[:100]}...")
+            logger.info(f"[transform_data] ✓ PDF concatenado exitosamente:")
+            logger.info(f"[transform_data] → Nueva URI: {nueva_uri}")
+            logger.info(f"[transform_data] → URL firmada: {url_firmada[:100]}...")
             
             # Agregar resultado al contexto para usar en pasos posteriores
             concatenacion_resultado = {
@@ -1091,10 +1454,10 @@ async def transform_data(context: dict, config: dict) -> dict:
             }
             
         else:
-            print(f"[transform_data] ⚠ Faltan datos para concatenación:")
-            print(f"[transform_data] → PDF URI: {'✓' if pdfUri else '✗'}")
-            print(f"[transform_data] → Imagen URI: {'✓' if imagen_uri else '✗'}")
-            print(f"[transform_data] → Página INE: {'✓' if paginaIne else '✗'}")
+            logger.warning(f"[transform_data] ⚠ Faltan datos para concatenación:")
+            logger.info(f"[transform_data] → PDF URI: {'✓' if pdfUri else '✗'}")
+            logger.info(f"[transform_data] → Imagen URI: {'✓' if imagen_uri else '✗'}")
+            logger.info(f"[transform_data] → Página INE: {'✓' if paginaIne else '✗'}")
             
             
             concatenacion_resultado = {
@@ -1108,7 +1471,7 @@ async def transform_data(context: dict, config: dict) -> dict:
             }
         
     except Exception as concatenacion_error:
-        print(f"[transform_data] ⚠ Error en concatenación de PDF: {str(concatenacion_error)}")
+        logger.warning(f"[transform_data] ⚠ Error en concatenación de PDF: {str(concatenacion_error)}")
         
         # En caso de error, mantener URIs originales
         concatenacion_resultado = {
@@ -1120,21 +1483,23 @@ async def transform_data(context: dict, config: dict) -> dict:
         }
 
     # === PRESERVAR CONTEXTO Y SOLO ANEXAR TU CAMPO ===
-    new_context = deepcopy(context)  # opcional; evita mutar el original
-
-    # Asegura el dict de dynamic_properties
-    prev_dp = new_context.get("dynamic_properties", {}) or {}
-    new_context["dynamic_properties"] = {
-        **prev_dp,
+    # Una sola resolución de evidencia_ine para los cuatro campos de abajo y
+    # el payload de completado (antes: un .get anidado con {} nuevo por campo)
+    evidencia = resultado_validacion_ine.get("evidencia_ine") or {}
+    gcs_uri_ev = evidencia.get("gcs_uri")
+
+    # El merge sobre dynamic_properties lo hace el despacho (contrato
+    # dp_updates); el step sólo declara sus claves nuevas
+    dp_updates = {
         "resultado_llm_modelo_ine": resultado_llm.get("resultado"),
         "resultado_validacion_ine": resultado_validacion_ine,
         "resultado_listas_negras": resultado_listas_negras,
         "redesSociales": json.loads(redesSociales),
         # Agregar información de evidencia de INE si está disponible
-        "evidencia_ine_disponible": resultado_validacion_ine.get("evidencia_ine", {}).get("gcs_uri") is not None if "evidencia_ine" in resultado_validacion_ine else False,
-        "evidencia_ine_gcs_uri": resultado_validacion_ine.get("evidencia_ine", {}).get("gcs_uri", "") if "evidencia_ine" in resultado_validacion_ine else "",
-        "evidencia_ine_signed_url": resultado_validacion_ine.get("evidencia_ine", {}).get("gcs_signed_url", "") if "evidencia_ine" in resultado_validacion_ine else "",
-        "evidencia_ine_filename": resultado_validacion_ine.get("evidencia_ine", {}).get("filename", "") if "evidencia_ine" in resultado_validacion_ine else "",
+        "evidencia_ine_disponible": gcs_uri_ev is not None,
+        "evidencia_ine_gcs_uri": gcs_uri_ev or "",
+        "evidencia_ine_signed_url": evidencia.get("gcs_signed_url", ""),
+        "evidencia_ine_filename": evidencia.get("filename", ""),
         # Agregar información de concatenación de PDF
         "concatenacion_pdf": concatenacion_resultado,
         "pdf_concatenado_uri": concatenacion_resultado.get("nueva_uri", pdfUri),
@@ -1150,7 +1515,7 @@ async def transform_data(context: dict, config: dict) -> dict:
             "ine_model_determined": resultado_llm.get("resultado") is not None,
             "ine_validation_completed": resultado_validacion_ine.get("validacion_exitosa", False),
             "validation_successful": resultado_validacion_ine.get("validacion_exitosa", False),
-            "evidencia_ine_capturada": resultado_validacion_ine.get("evidencia_ine", {}).get("gcs_uri") is not None if "evidencia_ine" in resultado_validacion_ine else False,
+            "evidencia_ine_capturada": gcs_uri_ev is not None,
             "listas_negras_consultadas": resultado_listas_negras is not None and "error" not in resultado_listas_negras,
             "apellido_consultado": resultado_llm.get("resultado", {}).get("apellido", "") if resultado_llm.get("resultado") else "",
             "concatenacion_pdf_exitosa": concatenacion_resultado.get("concatenacion_exitosa", False),
@@ -1159,7 +1524,7 @@ async def transform_data(context: dict, config: dict) -> dict:
         })
     
     return {
-        "context": new_context,
+        "dp_updates": dp_updates,
         "next": "decide"
          # Sigue por orden (no especificamos `next`)
     }
@@ -1170,24 +1535,26 @@ async def decide(context: dict, config: dict) -> dict:
     Decide aprobar o rechazar basado en el valor transformado.
     Parámetros en config: threshold (numérico)
     """
-    execution_id = context.get("execution_id") or context.get("dynamic_properties", {}).get("execution_id")
+    execution_id = current_execution_id.get()
   
     dynamic_props = context.get("dynamic_properties", {}) or {}
 
     datosExtracciones = dynamic_props.get("resultado_llm_extraccion_data", {}) if dynamic_props.get("resultado_llm_extraccion_data") else {"error":"no hay data"}
 
-    # Solo convertir a JSON si es string, si ya es dict dejarlo como está
-    if isinstance(datosExtracciones, str):
+    # Caso común primero: el step anterior normalmente ya dejó un dict
+    if isinstance(datosExtracciones, dict):
+        pass
+    elif isinstance(datosExtracciones, str):
         try:
-            datosExtracciones = json.loads(datosExtracciones)
-        except json.JSONDecodeError:
+            datosExtracciones = _loads(datosExtracciones)
+        except ValueError:
             datosExtracciones = {"error": "no se pudo parsear la data"}
-    elif not isinstance(datosExtracciones, dict):
+    else:
         # Si no es ni string ni dict, convertir a dict con error
         datosExtracciones = {"error": "tipo de dato no soportado"}
 
     if execution_id:
-        await report_progress(execution_id, "decide", {
+        report_progress_nowait(execution_id, "decide", {
             "percentage": 20,
             "message": "Iniciando decisión basada en datos extraídos",
             "current_task": "Preparando datos para análisis"
@@ -1197,7 +1564,9 @@ async def decide(context: dict, config: dict) -> dict:
         archivos_data = [
             {
                 "nombre": "detalle de extracciones",
-                "textPlano": datosExtracciones,
+                # Payload compactado: menos tokens de entrada para el mismo
+                # resultado (el modelo sólo necesita campos con valor)
+                "textPlano": _compactar_para_marcar(datosExtracciones),
                 "mimetype": "texto plano"
             }
         ]
@@ -1205,25 +1574,27 @@ async def decide(context: dict, config: dict) -> dict:
         nombre_modelo = "propiedades_a_marcar"
         
         if execution_id:
-            await report_progress(execution_id, "decide", {
+            report_progress_nowait(execution_id, "decide", {
                 "percentage": 50,
                 "message": f"Procesando con modelo {nombre_modelo}",
                 "current_task": "Determinando datos a marcar en PDF"
             })
         
-        resultado_llm = await procesar_con_modelo_dinamico_desde_bd(archivos_data, nombre_modelo)
+        # cached_llm corta la llamada completa cuando datosExtracciones es
+        # idéntico a una invocación reciente (re-ejecuciones, reintentos)
+        resultado_llm = await cached_llm(archivos_data, nombre_modelo)
         
-        print(f"[DECIDE] Resultado del procesamiento: {resultado_llm.get('resultado')}")
+        logger.info(f"[DECIDE] Resultado del procesamiento: {resultado_llm.get('resultado')}")
 
         if execution_id:
-            await report_progress(execution_id, "decide", {
+            report_progress_nowait(execution_id, "decide", {
                 "percentage": 90,
                 "message": "Completando decisión",
                 "current_task": "Preparando respuesta final"
             })
 
     except Exception as e:
-        print(f"[DECIDE] Error al procesar con modelo dinámico: {e}")
+        logger.warning(f"[DECIDE] Error al procesar con modelo dinámico: {e}")
         if execution_id:
             await report_completion(execution_id, "decide", {
                 "success": False,
@@ -1238,17 +1609,9 @@ async def decide(context: dict, config: dict) -> dict:
             "validacion_final": "Datos listos",
         })
         
-    # === PRESERVAR CONTEXTO Y SOLO ANEXAR TU CAMPO ===
-    new_context = deepcopy(context)  # opcional; evita mutar el original    
-        
-    prev_dp = new_context.get("dynamic_properties", {}) or {}
-    new_context["dynamic_properties"] = {
-        **prev_dp,
-        "campos_a_marcar_pdf": resultado_llm.get("resultado")
-    }
-    
+    # El merge sobre dynamic_properties lo hace el despacho (contrato dp_updates)
     return {
-            "context": new_context,
+            "dp_updates": {"campos_a_marcar_pdf": resultado_llm.get("resultado")},
             "next": "approve_user"
         }
 
@@ -1263,9 +1626,9 @@ async def approve_user(context: dict, config: dict) -> dict:
     
     """
     # Obtener execution_id para reportar progreso
-    execution_id = context.get("execution_id") or context.get("dynamic_properties", {}).get("execution_id")
+    execution_id = current_execution_id.get()
     if execution_id:
-        await report_progress(execution_id, "approve_user", {
+        report_progress_nowait(execution_id, "approve_user", {
             "percentage": 15,
             "message": "Colocando anotaciones en el PDF",
             "current_task": "Anotando PDF"
@@ -1282,19 +1645,20 @@ async def approve_user(context: dict, config: dict) -> dict:
     concatenacion_pdf = dynamic_props.get("concatenacion_pdf", "")
 
     # Debug: verificar qué está llegando del modelo dinámico
-    print(f"[APPROVE_USER - DEBUG] campos_a_marcar_pdf recibido: {campos_a_marcar_pdf}")
-    print(f"[APPROVE_USER - DEBUG] Tipo: {type(campos_a_marcar_pdf)}, Longitud: {len(campos_a_marcar_pdf) if campos_a_marcar_pdf else 0}")
+    logger.debug(f"[APPROVE_USER - DEBUG] campos_a_marcar_pdf recibido: {campos_a_marcar_pdf}")
+    logger.debug(f"[APPROVE_USER - DEBUG] Tipo: {type(campos_a_marcar_pdf)}, Longitud: {len(campos_a_marcar_pdf) if campos_a_marcar_pdf else 0}")
     
     #llamada a geminis
     
     # Ahora invocar GEMINIS para anotar el PDF con OCR
     if gcs_uri and resultado_llm:
         try:
-            print(f"[APPROVE_USER] Iniciando anotación con GEMINIS...")
+            logger.info(f"[APPROVE_USER] Iniciando anotación con GEMINIS...")
                             
-            # Verificar que GEMINIS esté disponible
-            if not check_geminis_health():
-                print("[APPROVE_USER] ADVERTENCIA: Servicio GEMINIS no disponible")
+            # Verificar que GEMINIS esté disponible (llamada HTTP síncrona:
+            # al thread pool para no bloquear el event loop)
+            if not await asyncio.to_thread(_geminis_healthy):
+                logger.warning("[APPROVE_USER] ADVERTENCIA: Servicio GEMINIS no disponible")
                 raise Exception("Servicio GEMINIS no disponible")
                             
             # Inicializar valores para anotar como lista vacía
@@ -1308,32 +1672,46 @@ async def approve_user(context: dict, config: dict) -> dict:
                     if campo.get("text") and campo.get("text").strip()
                 ]
                 valores_para_anotar.extend(campos_filtrados)
-                print(f"[APPROVE_USER] Agregados {len(campos_filtrados)} valores del modelo dinámico (filtrados de {len(campos_a_marcar_pdf)} originales)")
+                logger.info(f"[APPROVE_USER] Agregados {len(campos_filtrados)} valores del modelo dinámico (filtrados de {len(campos_a_marcar_pdf)} originales)")
                 
                 # Debug: mostrar objetos filtrados
                 objetos_filtrados = len(campos_a_marcar_pdf) - len(campos_filtrados)
                 if objetos_filtrados > 0:
-                    print(f"[APPROVE_USER] Se filtraron {objetos_filtrados} objetos con texto vacío del modelo dinámico")
+                    logger.info(f"[APPROVE_USER] Se filtraron {objetos_filtrados} objetos con texto vacío del modelo dinámico")
                             
-            # Extraer textos encontrados por el LLM para anotar en el PDF
-            for seccion, datos in resultado_llm.items():
-                if isinstance(datos, dict) and datos.get("presente", False):
-                    # Si la sección tiene textos extraídos, agregarlos
-                    textos = datos.get("textos", [])
-                    if isinstance(textos, list):
-                        for texto in textos[:3]:  # Limitar a 3 textos por sección
-                            if texto and len(texto.strip()) > 3:  # Filtrar textos muy cortos
-                                valores_para_anotar.append({
-                                    "text": texto.strip(),
-                                    "very_permissive": True,
-                                    "marker": seccion.upper()[:3],  # Usar primeras 3 letras como marcador
-                                    "marker_side": "right"
-                                })
+            # Extraer textos encontrados por el LLM para anotar en el PDF:
+            # un solo extend con filtros tempranos (secciones no presentes se
+            # descartan antes de tocar sus textos, máximo 3 por sección,
+            # textos cortos fuera) en lugar de appends uno a uno
+            valores_para_anotar.extend(
+                {
+                    "text": texto,
+                    "very_permissive": True,
+                    "marker": seccion.upper()[:3],  # Usar primeras 3 letras como marcador
+                    "marker_side": "right"
+                }
+                for seccion, datos in resultado_llm.items()
+                if isinstance(datos, dict) and datos.get("presente") and isinstance(datos.get("textos"), list)
+                for texto in (t.strip() for t in datos["textos"][:3] if isinstance(t, str))
+                if len(texto) > 3  # Filtrar textos muy cortos
+            )
                             
             # Si no hay valores específicos del modelo dinámico ni del LLM, usar algunos de ejemplo para pruebas
             if not valores_para_anotar:
-                print("[APPROVE_USER] ADVERTENCIA: No se encontraron valores del modelo dinámico, usando valores de ejemplo")
-                valores_para_anotar = [{'text': 'THE CHEMOURS COMPANY SERVICIOS, S. DE R.L. DE C.V.', 'very_permissive': False}, {'text': 'CSE140703QV7', 'very_permissive': False}, {'text': '2014/06/20', 'very_permissive': False}, {'text': 'GONZALEZ MARTINEZ, LUIS OSVALDO', 'very_permissive': False}, {'text': '55 5125 4847', 'very_permissive': False}, {'text': 'luis-osvaldo.gonzalez@chemours.com', 'very_permissive': False}, {'text': 'SERGIO RAUL SANMIGUEL GASTELUM', 'very_permissive': False, 'marker': 'PRESIDENTE'}, {'text': 'LUIS OSVALDO GONZALEZ MARTINEZ', 'very_permissive': False, 'marker': 'MIEMBRO PROPIETARIO'}, {'text': 'OMAR GOMEZ VELASCO', 'very_permissive': False, 'marker': 'MIEMBRO PROPIETARIO'}, {'text': 'SOCIEDAD DE RESPONSABILIDAD LIMITADA DE CAPITAL VARIABLE', 'very_permissive': False}, {'text': '03 DE JULIO DE 2014', 'very_permissive': False}, {'text': 'ACTIVO', 'very_permissive': False}, {'text': 'SNGSSR68110214H901', 'very_permissive': False}, {'text': '2012', 'very_permissive': False}, {'text': 'GNMRLS75010615H400', 'very_permissive': False}, {'text': '2019', 'very_permissive': False}, {'text': 'CLLE LAGO ZURICH 219 INT 205 AMPLIACION GRANADA MIGUEL HIDALGO CIUDAD DE MEXICO 11529 MEX', 'very_permissive': False}, {'text': 'LUIS REBOLLAR GONZALEZ', 'very_permissive': False, 'marker': 'Presidente'}, {'text': 'JAIME PEREZ VARGAS UHTHOFF', 'very_permissive': False, 'marker': 'Miembro Propietario'}, {'text': '517312', 'very_permissive': False, 'marker': 'RPP'}]
+                if not _GEMINIS_USAR_FALLBACK:
+                    raise _OmitirGeminis
+                logger.warning("[APPROVE_USER] ADVERTENCIA: No se encontraron valores del modelo dinámico, usando valores de ejemplo")
+                # Sólo se copia la lista: los dicts elemento nunca se mutan
+                # (el extend posterior agrega dicts nuevos), así que se
+                # comparten entre requests
+                valores_para_anotar = list(_DEFAULT_VALORES_PARA_ANOTAR)
+
+            if len(valores_para_anotar) > _MAX_VALORES_ANOTAR:
+                # Log para observar si el tope de 200 es el correcto
+                logger.warning("[APPROVE_USER] valores_para_anotar truncado de %d a %d",
+                               len(valores_para_anotar), _MAX_VALORES_ANOTAR)
+                valores_para_anotar.sort(key=lambda v: -len(v.get("text") or ""))
+                del valores_para_anotar[_MAX_VALORES_ANOTAR:]
                             
             #agregar al arreglo de valores_para_anotar
            
@@ -1375,19 +1753,19 @@ async def approve_user(context: dict, config: dict) -> dict:
             paginaIne = data["paginaIneApoderado"]["paginaIneApoderado"]
             
             # Debug: verificar datos del INE
-            print(f"[APPROVE_USER - DEBUG] dataIne: {dataIne}")
-            print(f"[APPROVE_USER - DEBUG] paginaIne: {paginaIne}")
+            logger.debug(f"[APPROVE_USER - DEBUG] dataIne: {dataIne}")
+            logger.debug(f"[APPROVE_USER - DEBUG] paginaIne: {paginaIne}")
             
             parrafoIne = "\n".join([f"{clave}: {valor}" for clave, valor in dataIne.items()])
             
             # Debug: verificar texto generado
-            print(f"[APPROVE_USER - DEBUG] parrafoIne generado: {parrafoIne}")
+            logger.debug(f"[APPROVE_USER - DEBUG] parrafoIne generado: {parrafoIne}")
             
             # PASO NUEVO: Marcar el PDF con el párrafo del INE antes de usar GEMINIS
             try:
                 from app.utils.marcarPDF import MarcadorPDF
                 
-                print(f"[APPROVE_USER] Marcando página {paginaIne} con información del INE...")
+                logger.info(f"[APPROVE_USER] Marcando página {paginaIne} con información del INE...")
                 
                 # Crear instancia del marcador
                 marcador = MarcadorPDF(bucket_name="perdidas-totales-pruebas")
@@ -1405,22 +1783,22 @@ async def approve_user(context: dict, config: dict) -> dict:
                 hope = concatenacion_pdf.get("nueva_uri", "")
 
                 if resultado_marcado_ine["success"]:
-                    print(f"[APPROVE_USER] ✓ PDF marcado con info INE: {resultado_marcado_ine['uri_marcado']}")
-                    print(f"[APPROVE_USER] ✓ Texto agregado: {resultado_marcado_ine['texto_agregado']}")
+                    logger.info(f"[APPROVE_USER] ✓ PDF marcado con info INE: {resultado_marcado_ine['uri_marcado']}")
+                    logger.info(f"[APPROVE_USER] ✓ Texto agregado: {resultado_marcado_ine['texto_agregado']}")
                     
                     # Actualizar el gcs_uri para usar el PDF marcado en GEMINIS
                     gcs_uri_original = gcs_uri
                     gcs_uri = resultado_marcado_ine['uri_marcado']
                     
-                    print(f"[APPROVE_USER] → Usando PDF marcado para GEMINIS: {gcs_uri}")
+                    logger.info(f"[APPROVE_USER] → Usando PDF marcado para GEMINIS: {gcs_uri}")
                     
                 else:
-                    print(f"[APPROVE_USER] ⚠ Error marcando PDF con info INE: {resultado_marcado_ine.get('error', 'Error desconocido')}")
-                    print(f"[APPROVE_USER] → Continuando con PDF original")
+                    logger.warning(f"[APPROVE_USER] ⚠ Error marcando PDF con info INE: {resultado_marcado_ine.get('error', 'Error desconocido')}")
+                    logger.info(f"[APPROVE_USER] → Continuando con PDF original")
                     
             except Exception as marcado_ine_error:
-                print(f"[APPROVE_USER] ⚠ Error en marcado INE: {str(marcado_ine_error)}")
-                print(f"[APPROVE_USER] → Continuando con PDF original")
+                logger.warning(f"[APPROVE_USER] ⚠ Error en marcado INE: {str(marcado_ine_error)}")
+                logger.info(f"[APPROVE_USER] → Continuando con PDF original")
 
            
             marcaIne = {
@@ -1455,16 +1833,18 @@ async def approve_user(context: dict, config: dict) -> dict:
             ])
 
             # Debug: mostrar los últimos elementos agregados
-            print(f"[APPROVE_USER - DEBUG] cabecera492 agregado: {cabecera492}")
-            print(f"[APPROVE_USER - DEBUG] marcaIne agregado: {marcaIne}")
-            print(f"[APPROVE_USER - DEBUG] cabecera492_simple agregado: {cabecera492_simple}")
-            print(f"[APPROVE_USER - DEBUG] marcaIne_simple agregado: {marcaIne_simple}")
-            print(f"[APPROVE_USER - DEBUG] Total final de valores: {len(valores_para_anotar)}")
-
-            print(f"[APPROVE_USER] Anotando {len(valores_para_anotar)} valores con GEMINIS")
-
-            # Llamar a GEMINIS de forma síncrona
-            geminis_result = process_pdf_with_geminis(
+            logger.debug(f"[APPROVE_USER - DEBUG] cabecera492 agregado: {cabecera492}")
+            logger.debug(f"[APPROVE_USER - DEBUG] marcaIne agregado: {marcaIne}")
+            logger.debug(f"[APPROVE_USER - DEBUG] cabecera492_simple agregado: {cabecera492_simple}")
+            logger.debug(f"[APPROVE_USER - DEBUG] marcaIne_simple agregado: {marcaIne_simple}")
+            logger.debug(f"[APPROVE_USER - DEBUG] Total final de valores: {len(valores_para_anotar)}")
+
+            logger.info(f"[APPROVE_USER] Anotando {len(valores_para_anotar)} valores con GEMINIS")
+
+            # GEMINIS es síncrono (requests): se despacha a un hilo para que
+            # el event loop siga atendiendo otros workflows mientras anota
+            geminis_result = await asyncio.to_thread(
+                process_pdf_with_geminis,
                 pdf_uri=hope,
                 values=valores_para_anotar,
                 dest_folder=f"procesos/{dynamic_props.get('uuid_proceso', 'uuid_default')}/anotados",
@@ -1479,22 +1859,28 @@ async def approve_user(context: dict, config: dict) -> dict:
             pdf_anotado_uri = geminis_result.get("output_uri")
             pdf_anotado_signed_url = None
             
-            # Generar URL firmada para el PDF anotado si se creó exitosamente
+            # Lanzar la firma de URL como tarea (RSA/RPC de IAM en hilo) y
+            # solapar con el trabajo serial que sigue
+            tarea_url_firmada = None
             if pdf_anotado_uri:
+                gcs_manager = _gcs()
+                tarea_url_firmada = asyncio.create_task(asyncio.to_thread(
+                    gcs_manager.get_signed_url_from_uri,
+                    pdf_anotado_uri,
+                    expiration_hours=24  # Válida por 24 horas
+                ))
+                            
+            logger.info(f"[APPROVE_USER] PDF anotado completado: {pdf_anotado_uri}")
+            logger.info(f"[APPROVE_USER] Tiempo de anotación: {geminis_result.get('processing_time_seconds', 0)}s")
+            logger.info(f"[APPROVE_USER] Valores anotados: {geminis_result.get('summary', {})}")
+
+            if tarea_url_firmada is not None:
                 try:
-                    gcs_manager = GCSFileManager()
-                    pdf_anotado_signed_url = gcs_manager.get_signed_url_from_uri(
-                        pdf_anotado_uri, 
-                        expiration_hours=24  # Válida por 24 horas
-                    )
-                    print(f"[APPROVE_USER] URL firmada generada para PDF anotado: {pdf_anotado_signed_url[:100]}...")
+                    pdf_anotado_signed_url = await tarea_url_firmada
+                    logger.info(f"[APPROVE_USER] URL firmada generada para PDF anotado: {pdf_anotado_signed_url[:100]}...")
                 except Exception as url_error:
-                    print(f"[APPROVE_USER] Error generando URL firmada para PDF anotado: {url_error}")
+                    logger.warning(f"[APPROVE_USER] Error generando URL firmada para PDF anotado: {url_error}")
                     pdf_anotado_signed_url = None
-                            
-            print(f"[APPROVE_USER] PDF anotado completado: {pdf_anotado_uri}")
-            print(f"[APPROVE_USER] Tiempo de anotación: {geminis_result.get('processing_time_seconds', 0)}s")
-            print(f"[APPROVE_USER] Valores anotados: {geminis_result.get('summary', {})}")
             
             if execution_id:
                 await report_completion(execution_id, "approve_user", {
@@ -1504,8 +1890,13 @@ async def approve_user(context: dict, config: dict) -> dict:
                     "pdf_anotado_signed_url_generada": pdf_anotado_signed_url is not None
                 })
                             
+        except _OmitirGeminis:
+            logger.info("[APPROVE_USER] Sin valores para anotar y fallback deshabilitado: se omite GEMINIS")
+            geminis_result = {"skipped": "sin valores para anotar"}
+            pdf_anotado_uri = None
+            pdf_anotado_signed_url = None
         except Exception as geminis_error:
-            print(f"[APPROVE_USER] Error en anotación GEMINIS: {str(geminis_error)}")
+            logger.warning(f"[APPROVE_USER] Error en anotación GEMINIS: {str(geminis_error)}")
             # Continuar sin anotación si hay error
             geminis_result = {"error": str(geminis_error)}
             pdf_anotado_uri = None
@@ -1515,11 +1906,8 @@ async def approve_user(context: dict, config: dict) -> dict:
         pdf_anotado_uri = None
         pdf_anotado_signed_url = None
     
-    new_context = deepcopy(context)  # opcional; evita mutar el original    
-        
-    prev_dp = new_context.get("dynamic_properties", {}) or {}
-    new_context["dynamic_properties"] = {
-        **prev_dp,
+    # El merge sobre dynamic_properties lo hace el despacho (contrato dp_updates)
+    dp_updates = {
         "pdf_anotado_uri": pdf_anotado_uri,
         "pdf_anotado_signed_url": pdf_anotado_signed_url
     }
@@ -1588,25 +1976,25 @@ async def approve_user(context: dict, config: dict) -> dict:
                 
                 # Verificar resultados
                 if props_updated:
-                    print(f"[APPROVE_USER] ✓ Propiedades de Discovery actualizadas para {execution_id}")
+                    logger.info(f"[APPROVE_USER] ✓ Propiedades de Discovery actualizadas para {execution_id}")
                 else:
-                    print(f"[APPROVE_USER] ⚠ No se pudieron actualizar las propiedades de Discovery")
+                    logger.warning(f"[APPROVE_USER] ⚠ No se pudieron actualizar las propiedades de Discovery")
                     
                 if workflow_completed:
-                    print(f"[APPROVE_USER] ✓ Workflow {execution_id} marcado como completado en Discovery")
+                    logger.info(f"[APPROVE_USER] ✓ Workflow {execution_id} marcado como completado en Discovery")
                 else:
-                    print(f"[APPROVE_USER] ⚠ No se pudo marcar workflow como completado, pero el procesamiento fue exitoso")
+                    logger.warning(f"[APPROVE_USER] ⚠ No se pudo marcar workflow como completado, pero el procesamiento fue exitoso")
             except Exception as workflow_optional_error:
-                print(f"[APPROVE_USER] ⚠ Error opcional marcando workflow: {workflow_optional_error}")
+                logger.warning(f"[APPROVE_USER] ⚠ Error opcional marcando workflow: {workflow_optional_error}")
             
-            print(f"[APPROVE_USER] ✓ Procesamiento completado para execution_id: {execution_id}")
-            print(f"[APPROVE_USER] ✓ Estado del expediente: {expedienteCompleto}")
+            logger.info(f"[APPROVE_USER] ✓ Procesamiento completado para execution_id: {execution_id}")
+            logger.info(f"[APPROVE_USER] ✓ Estado del expediente: {expedienteCompleto}")
             
         except Exception as workflow_error:
-            print(f"[APPROVE_USER] Error en finalización de workflow: {workflow_error}")
+            logger.warning(f"[APPROVE_USER] Error en finalización de workflow: {workflow_error}")
 
     return {
-        "context": new_context,
+        "dp_updates": dp_updates,
         # NO agregar "next" para indicar que es el final del workflow
         "workflow_status": "completed",
         "workflow_completed": True,  # Flag explícito para Discovery
@@ -1635,7 +2023,7 @@ async def reject_user(context: dict, config: dict) -> dict:
     
     documents = data["resultado_llm_extraccion_data"]["documents"]
     
-    execution_id = context.get("execution_id") or context.get("dynamic_properties", {}).get("execution_id")
+    execution_id = current_execution_id.get()
 
     
     await report_completion(execution_id, "approve_user", {
@@ -36,6 +36,7 @@ Uso básico:
 """
 
 import base64
+import os
 import uuid
 import logging
 import io
@@ -49,15 +50,50 @@ from app.core2.config import vertexSettings
 
 logger = logging.getLogger(__name__)
 
+# Cliente de storage compartido a nivel módulo: crear un storage.Client
+# levanta credenciales y un pool HTTP propio, así que instanciar uno por
+# GCSFileManager multiplica sockets y handshakes sin necesidad
+_storage_client = None
+_storage_client_lock = threading.Lock()
+
+
+def _get_storage_client() -> storage.Client:
+    global _storage_client
+    if _storage_client is None:
+        with _storage_client_lock:
+            if _storage_client is None:
+                _storage_client = storage.Client(project=vertexSettings.VERTEXAI_PROJECT)
+    return _storage_client
+
 
 class GCSFileManager:
     """
     Clase centralizada para manejar archivos en Google Cloud Storage
     """
     
+    # Tamaño de chunk para subidas resumables, configurable vía
+    # GCS_UPLOAD_CHUNK_MB (múltiplo de 256 KiB, como exige la API de GCS);
+    # chunks de 16 MiB rinden mejor para archivos de más de 10 MB
+    RESUMABLE_CHUNK_SIZE = int(os.getenv("GCS_UPLOAD_CHUNK_MB", "16")) * 1024 * 1024
+
+    # Por debajo de este tamaño conviene una subida single-shot en lugar de
+    # abrir una sesión resumable (una petición menos por archivo)
+    SINGLE_SHOT_MAX_BYTES = 8 * 1024 * 1024
+
+    # Cache de URLs firmadas: firmar implica una operación RSA (o un RPC de
+    # signBlob a IAM cuando no hay llave local) y la misma URL de 24h se pide
+    # varias veces a lo largo de un workflow. Se reutiliza mientras le quede
+    # al menos la mitad de su vigencia. Clave: (blob_name, expiration_hours).
+    # Acotado: los nombres de blob llevan uuid y muchos no se vuelven a pedir,
+    # así que al insertar se purgan las entradas vencidas y, si aún se excede
+    # el tope, se descartan las más antiguas (orden de inserción)
+    _SIGNED_URL_CACHE_MAX_ENTRADAS = 1024
+    _signed_url_cache: Dict[tuple, tuple] = {}
+    _signed_url_cache_lock = threading.Lock()
+
     def __init__(self):
         """Inicializa el cliente de Google Cloud Storage"""
-        self.storage_client = storage.Client(project=vertexSettings.VERTEXAI_PROJECT)
+        self.storage_client = _get_storage_client()
         self.bucket_name = "bucket_poc_art492"  # Usar el bucket hardcodeado por ahora
         self.bucket = self.storage_client.bucket(self.bucket_name)
         
@@ -111,6 +147,93 @@ class GCSFileManager:
             logger.error(f"Error subiendo el archivo: {e}")
             raise e
 
+    def upload_bytes(self, data: bytes, mime_type: str,
+                     nombre_archivo: str, label: str) -> Dict[str, Any]:
+        """
+        Sube bytes ya decodificados a GCS mediante una subida resumable por chunks.
+
+        Pensado para llamadores que ya decodificaron el base64 (por ejemplo para
+        validarlo): evita una segunda decodificación y no materializa más de un
+        chunk en el buffer de red a la vez.
+
+        Args:
+            data: Contenido binario del archivo
+            mime_type: Tipo MIME del archivo
+            nombre_archivo: Nombre original del archivo
+            label: Etiqueta identificadora del archivo
+
+        Returns:
+            Dict con información del archivo subido (mismo formato que upload_file_base64)
+
+        Raises:
+            Exception: Si hay error en la subida del archivo
+        """
+        try:
+            # Generamos un nombre único para evitar colisiones
+            unique_filename = f"{uuid.uuid4()}_{nombre_archivo}"
+
+            if len(data) <= self.SINGLE_SHOT_MAX_BYTES:
+                blob = self.bucket.blob(unique_filename)
+                blob.upload_from_string(data, content_type=mime_type)
+            else:
+                blob = self.bucket.blob(unique_filename, chunk_size=self.RESUMABLE_CHUNK_SIZE)
+                blob.upload_from_file(io.BytesIO(data), size=len(data),
+                                      content_type=mime_type, rewind=True)
+
+            uri = f"gs://{self.bucket_name}/{unique_filename}"
+            logger.info(f"Archivo subido exitosamente: {uri}")
+
+            return {
+                "label": label,
+                "uri": uri,
+                "file": {
+                    "mime_type": mime_type,
+                    "file_uri": uri
+                },
+            }
+        except Exception as e:
+            logger.error(f"Error subiendo el archivo: {e}")
+            raise e
+
+    def upload_bytes_with_auto_delete(self, data: bytes, mime_type: str,
+                                      nombre_archivo: str, label: str,
+                                      auto_delete: Union[bool, int] = False) -> Dict[str, Any]:
+        """
+        Sube bytes ya decodificados a GCS con opción de eliminación automática.
+
+        Args:
+            data: Contenido binario del archivo
+            mime_type: Tipo MIME del archivo
+            nombre_archivo: Nombre original del archivo
+            label: Etiqueta identificadora del archivo
+            auto_delete: Si es True, elimina inmediatamente después de subir.
+                        Si es un entero, elimina después de ese número de segundos.
+                        Si es False, no elimina automáticamente.
+
+        Returns:
+            Dict con información del archivo subido (mismo formato que upload_bytes)
+        """
+        try:
+            result = self.upload_bytes(data, mime_type, nombre_archivo, label)
+
+            # Manejar eliminación automática
+            if auto_delete is True:
+                self.delete_files_by_uris([result["uri"]])
+                logger.info(f"Archivo {result['uri']} eliminado inmediatamente después de subir")
+                result["auto_deleted"] = True
+                result["deleted_at"] = "immediate"
+            elif isinstance(auto_delete, int) and auto_delete > 0:
+                self._schedule_file_deletion(result["uri"], auto_delete)
+                result["auto_delete_scheduled"] = True
+                result["delete_after_seconds"] = auto_delete
+                logger.info(f"Programada eliminación automática de {result['uri']} en {auto_delete} segundos")
+
+            return result
+
+        except Exception as e:
+            logger.error(f"Error subiendo el archivo con auto-eliminación: {e}")
+            raise e
+
     def generate_signed_url(self, blob_name: str, expiration_hours: int = 24) -> str:
         """
         Genera una URL firmada para acceder a un archivo en GCS sin autenticación.
@@ -127,7 +250,14 @@ class GCSFileManager:
         """
         try:
             from datetime import timedelta
-            
+
+            clave = (blob_name, expiration_hours)
+            ahora = time.monotonic()
+            with self._signed_url_cache_lock:
+                entrada = self._signed_url_cache.get(clave)
+                if entrada is not None and entrada[0] > ahora:
+                    return entrada[1]
+
             blob = self.bucket.blob(blob_name)
             
             # Generar URL firmada válida por el tiempo especificado
@@ -136,6 +266,16 @@ class GCSFileManager:
                 expiration=timedelta(hours=expiration_hours),
                 method="GET"
             )
+
+            with self._signed_url_cache_lock:
+                cache = self._signed_url_cache
+                if len(cache) >= self._SIGNED_URL_CACHE_MAX_ENTRADAS:
+                    vencidas = [c for c, (expira_en, _) in cache.items() if expira_en <= ahora]
+                    for c in vencidas:
+                        cache.pop(c, None)
+                    while len(cache) >= self._SIGNED_URL_CACHE_MAX_ENTRADAS:
+                        cache.pop(next(iter(cache)), None)
+                cache[clave] = (ahora + expiration_hours * 1800, signed_url)
             
             logger.info(f"URL firmada generada para {blob_name}, válida por {expiration_hours} horas")
             return signed_url
@@ -239,6 +379,65 @@ class GCSFileManager:
             logger.error(f"Error subiendo el archivo a GCS: {e}")
             raise e
 
+    def upload_bytes_to_folder(self, data: bytes, mime_type: str,
+                               filename: str, folder: str, include_signed_url: bool = False,
+                               signed_url_expiration_hours: int = 24) -> Dict[str, Any]:
+        """
+        Sube bytes ya decodificados a una carpeta específica en GCS.
+
+        Variante de upload_file_to_folder para llamadores que ya tienen el
+        contenido binario: evita el decode de base64 dentro del manager y usa
+        subida resumable por chunks para payloads grandes.
+
+        Args:
+            data: Contenido binario del archivo
+            mime_type: Tipo MIME del archivo
+            filename: Nombre del archivo
+            folder: Nombre de la carpeta destino
+            include_signed_url: Si True, incluye una URL firmada en la respuesta
+            signed_url_expiration_hours: Horas de validez de la URL firmada
+
+        Returns:
+            Dict con información del archivo subido (mismo formato que upload_file_to_folder)
+        """
+        try:
+            # Generar un nombre único para evitar colisiones
+            object_id = str(uuid.uuid4())
+            blob_name = f"{folder}/{object_id}_{filename}"
+
+            if len(data) <= self.SINGLE_SHOT_MAX_BYTES:
+                blob = self.bucket.blob(blob_name)
+                blob.upload_from_string(data, content_type=mime_type)
+            else:
+                blob = self.bucket.blob(blob_name, chunk_size=self.RESUMABLE_CHUNK_SIZE)
+                blob.upload_from_file(io.BytesIO(data), size=len(data),
+                                      content_type=mime_type, rewind=True)
+
+            uri = f"gs://{self.bucket_name}/{blob_name}"
+            logger.info(f"Archivo subido a carpeta: {uri}")
+
+            result = {
+                "filename": filename,
+                "uri": uri,
+                "object_id": object_id,
+                "folder": folder,
+                "mime_type": mime_type
+            }
+
+            if include_signed_url:
+                try:
+                    signed_url = self.generate_signed_url(blob_name, signed_url_expiration_hours)
+                    result["signed_url"] = signed_url
+                    logger.info(f"URL firmada generada para {uri}")
+                except Exception as url_error:
+                    logger.warning(f"No se pudo generar URL firmada para {uri}: {url_error}")
+                    result["signed_url_error"] = str(url_error)
+
+            return result
+        except Exception as e:
+            logger.error(f"Error subiendo el archivo a GCS: {e}")
+            raise e
+
     def upload_multiple_files(self, archivos: List[Dict], max_workers: int = 5) -> List[Dict]:
         """
         Sube múltiples archivos de forma concurrente.
@@ -1,6 +1,7 @@
 import io
 import os
 import tempfile
+from contextlib import suppress
 from pathlib import Path
 from urllib.parse import urlparse
 from typing import Tuple, Optional
@@ -193,14 +194,11 @@ def concatenar_pdf_con_imagen(pdf_uri: str, imagen_uri: str, pagina_insercion: i
         raise Exception(f"Error durante la concatenación de PDF: {e}")
     
     finally:
-        # Limpiar archivos temporales
+        # Limpiar archivos temporales: unlink directo (un syscall por ruta);
+        # si el archivo ya no existe o no se puede borrar, se suprime
         for temp_file in temp_files:
-            try:
-                if os.path.exists(temp_file):
-                    os.unlink(temp_file)
-                    logger.debug(f"Archivo temporal eliminado: {temp_file}")
-            except Exception as e:
-                logger.warning(f"No se pudo eliminar archivo temporal {temp_file}: {e}")
+            with suppress(OSError):
+                os.unlink(temp_file)
 
 
 def _convertir_imagen_a_pdf(imagen_path: str) -> str:
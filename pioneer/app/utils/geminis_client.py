@@ -137,6 +137,20 @@ class GeminisClient:
             return {"error": str(e)}
 
 
+# Clientes reutilizados por URL: cada GeminisClient trae su propia Session de
+# requests con pool de conexiones; reciclarlos mantiene los keep-alive vivos
+# entre documentos en lugar de rehacer el handshake TCP en cada llamada
+_clients: Dict[str, GeminisClient] = {}
+
+
+def _get_client(geminis_url: str) -> GeminisClient:
+    client = _clients.get(geminis_url)
+    if client is None:
+        client = GeminisClient(base_url=geminis_url)
+        _clients[geminis_url] = client
+    return client
+
+
 # Funciones de conveniencia para usar directamente
 def process_pdf_with_geminis(pdf_uri: str, values: List[Union[str, Dict]], 
                            dest_folder: str = "documentos_anotados",
@@ -155,7 +169,7 @@ def process_pdf_with_geminis(pdf_uri: str, values: List[Union[str, Dict]],
     Returns:
         Resultado del procesamiento
     """
-    client = GeminisClient(base_url=geminis_url)
+    client = _get_client(geminis_url)
     return client.process_pdf_sync(pdf_uri, values, dest_folder, options)
 
 
@@ -169,5 +183,5 @@ def check_geminis_health(geminis_url: str = "http://geminis:8093/geminis") -> bo
     Returns:
         True si está disponible
     """
-    client = GeminisClient(base_url=geminis_url)
+    client = _get_client(geminis_url)
     return client.health_check()
\ No newline at end of file
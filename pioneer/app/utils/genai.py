@@ -72,69 +72,89 @@ def configure_generation_config(modelo: OcrConfigModelo):
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def crear_documento_imagen(b64: str, mime_type: str):
+def crear_documento_imagen_bytes(data_bytes: bytes, mime_type: str):
+    """Crea un Part de Vertex AI a partir de bytes ya decodificados.
+
+    Los llamadores que ya decodificaron el base64 (por ejemplo para validar el
+    archivo) pueden reutilizar los bytes sin pagar una segunda decodificación.
+    """
     try:
         logger.info(f"Creando documento con mime_type: {mime_type}")
-        
+
+        if not data_bytes or not mime_type:
+            raise ValueError("El contenido y el tipo MIME son obligatorios.")
+
+        # Log de los primeros bytes para debugging
+        header_bytes = data_bytes[:10]
+        logger.info(f"Primeros 10 bytes del archivo: {header_bytes}")
+
+        # Validación específica para PDFs - pero más flexible
+        if mime_type == "application/pdf":
+            if not data_bytes.startswith(b'%PDF-'):
+                logger.warning("El archivo no parece ser un PDF válido (no tiene header %PDF-)")
+                # En lugar de fallar, intentamos detectar el tipo real
+                if data_bytes.startswith(b'\x89PNG'):
+                    logger.info("Detectado como imagen PNG, cambiando mime_type")
+                    mime_type = "image/png"
+                elif data_bytes.startswith(b'\xff\xd8\xff'):
+                    logger.info("Detectado como imagen JPEG, cambiando mime_type")
+                    mime_type = "image/jpeg"
+                elif data_bytes.startswith(b'GIF'):
+                    logger.info("Detectado como imagen GIF, cambiando mime_type")
+                    mime_type = "image/gif"
+                elif data_bytes.startswith(b'RIFF') and b'WEBP' in data_bytes[:12]:
+                    logger.info("Detectado como imagen WEBP, cambiando mime_type")
+                    mime_type = "image/webp"
+                else:
+                    logger.warning(f"Tipo de archivo no reconocido. Primeros bytes: {header_bytes}")
+                    # Intentamos continuar con el mime_type original
+            else:
+                logger.info("PDF header válido encontrado")
+
+        # Crear el documento con los bytes decodificados
+        logger.info(f"Creando Part.from_data con {len(data_bytes)} bytes y mime_type: {mime_type}")
+        doc = Part.from_data(
+            mime_type=mime_type,
+            data=data_bytes,
+        )
+        logger.info("Part.from_data creado exitosamente")
+        return doc
+    except Exception as e:
+        logger.error(f"Error al crear el documento de imagen: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Error al procesar la imagen: {e}"
+        )
+
+
+def crear_documento_imagen(b64: str, mime_type: str):
+    try:
         if not b64 or not mime_type:
             raise ValueError("El contenido base64 y el tipo MIME son obligatorios.")
-        
+
         # Log inicial
         logger.info(f"Base64 original length: {len(b64)}")
-        
+
         # Limpiar el base64 si viene con prefijo data:
         if "," in b64:
             b64 = b64.split(",", 1)[1]
             logger.info(f"Base64 después de limpiar prefijo data: length: {len(b64)}")
-        
+
         # Decodificar el base64 a bytes
         try:
             data_bytes = base64.b64decode(b64)
             logger.info(f"Base64 decodificado exitosamente. Bytes length: {len(data_bytes)}")
-            
+
             # Verificar que realmente tenemos datos
             if len(data_bytes) == 0:
                 raise ValueError("El archivo decodificado está vacío")
-            
-            # Log de los primeros bytes para debugging
-            header_bytes = data_bytes[:10]
-            logger.info(f"Primeros 10 bytes del archivo: {header_bytes}")
-            
-            # Validación específica para PDFs - pero más flexible
-            if mime_type == "application/pdf":
-                if not data_bytes.startswith(b'%PDF-'):
-                    logger.warning("El archivo no parece ser un PDF válido (no tiene header %PDF-)")
-                    # En lugar de fallar, intentamos detectar el tipo real
-                    if data_bytes.startswith(b'\x89PNG'):
-                        logger.info("Detectado como imagen PNG, cambiando mime_type")
-                        mime_type = "image/png"
-                    elif data_bytes.startswith(b'\xff\xd8\xff'):
-                        logger.info("Detectado como imagen JPEG, cambiando mime_type")
-                        mime_type = "image/jpeg"
-                    elif data_bytes.startswith(b'GIF'):
-                        logger.info("Detectado como imagen GIF, cambiando mime_type")
-                        mime_type = "image/gif"
-                    elif data_bytes.startswith(b'RIFF') and b'WEBP' in data_bytes[:12]:
-                        logger.info("Detectado como imagen WEBP, cambiando mime_type")
-                        mime_type = "image/webp"
-                    else:
-                        logger.warning(f"Tipo de archivo no reconocido. Primeros bytes: {header_bytes}")
-                        # Intentamos continuar con el mime_type original
-                else:
-                    logger.info("PDF header válido encontrado")
-                    
         except Exception as decode_error:
             logger.error(f"Error al decodificar base64: {decode_error}")
             raise ValueError(f"Base64 inválido: {decode_error}")
-        
-        # Crear el documento con los bytes decodificados
-        logger.info(f"Creando Part.from_data con {len(data_bytes)} bytes y mime_type: {mime_type}")
-        doc = Part.from_data(
-            mime_type=mime_type,
-            data=data_bytes,
-        )
-        logger.info("Part.from_data creado exitosamente")
-        return doc
+
+        return crear_documento_imagen_bytes(data_bytes, mime_type)
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error al crear el documento de imagen: {e}")
         raise HTTPException(
@@ -143,24 +163,41 @@ def crear_documento_imagen(b64: str, mime_type: str):
         )
 
 
+# Instancias de GenerativeModel reutilizadas entre llamadas: construirlas es
+# barato pero no gratis, y mantener el system_instruction byte-idéntico entre
+# invocaciones del mismo modelo permite que el caching implícito de prefijos
+# de Gemini abarate los tokens del prompt estable
+_model_cache: Dict[tuple, GenerativeModel] = {}
+
+
+def _obtener_model_generator(nombre_modelo: str, system_prompt: str) -> GenerativeModel:
+    clave = (nombre_modelo, system_prompt)
+    model_generator = _model_cache.get(clave)
+    if model_generator is None:
+        model_generator = GenerativeModel(nombre_modelo, system_instruction=[system_prompt])
+        _model_cache[clave] = model_generator
+    return model_generator
+
+
 def generar_texto_imagen_con_modelo_part(listaDocumentos: str, listadoImagenes: List, modelo: OcrConfigModeloRead):
     try:
-        # Generar prompt con información del modelo
-        prompt = f"""{modelo.descripcion}
-Te estoy mandando un total de {len(listadoImagenes)} archivos para que los analices y extraigas la información que se te solicita.
+        # Prefijo estable primero (descripcion, instrucciones fijas y notes) y
+        # lo variable (cantidad de archivos y listado) al final: el caching de
+        # prefijos sólo aplica sobre el inicio compartido del prompt
+        prompt_estatico = f"""{modelo.descripcion}
 No quiero que dividas la respuesta en partes. La respuesta debe ser completa.
+modelo
+{modelo.notes}
+"""
+        prompt = f"""{prompt_estatico}
+Te estoy mandando un total de {len(listadoImagenes)} archivos para que los analices y extraigas la información que se te solicita.
 La lista de documentos es la siguiente:
 
 {listaDocumentos}
-modelo
-{modelo.notes}
 """
         
-        # Obtener el nombre del modelo
-        model_generator = GenerativeModel(
-            modelo.nombre_modelo,
-            system_instruction=[prompt]
-        )
+        # Obtener el modelo (reutilizado si ya existe para este prefijo)
+        model_generator = _obtener_model_generator(modelo.nombre_modelo, prompt_estatico)
         
         # Agrupar para generar el contenido
         content = []
@@ -0,0 +1,99 @@
+"""Cache de resultados de extracción del modelo dinámico.
+
+La inferencia del LLM domina la latencia y el costo de los steps; cuando el
+mismo documento se reprocesa (reintentos, re-ejecuciones manuales, pruebas)
+el resultado es determinista para el mismo (contenido, modelo), así que se
+cachea en memoria con TTL, keyed por SHA-256 del contenido.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from typing import Any, Dict, List
+
+from app.service.modelo_dinamico_simplified import procesar_con_modelo_dinamico_desde_bd
+
+logger = logging.getLogger(__name__)
+
+# TTL y tamaño máximo del cache en memoria (clave -> (expira_en, resultado))
+_CACHE_TTL = 3600
+_CACHE_MAX_ENTRIES = 256
+_cache: Dict[str, tuple] = {}
+
+# Límite de inferencias concurrentes: una ráfaga de workflows sin control
+# termina en 429s y respuestas lentas del endpoint del LLM
+_llm_sem = asyncio.Semaphore(int(os.getenv("LLM_MAX_CONCURRENCY", "16")))
+
+
+def _cache_key(archivos_data: List[Dict[str, Any]], nombre_modelo: str) -> str:
+    """Deriva una clave estable de (modelo, contenido de cada documento)."""
+    h = hashlib.sha256()
+    h.update(nombre_modelo.encode("utf-8"))
+    for documento in archivos_data:
+        for campo in ("nombre", "mimetype", "url"):
+            valor = documento.get(campo)
+            if valor:
+                h.update(b"|")
+                h.update(str(valor).encode("utf-8"))
+        b64 = documento.get("base64")
+        if b64:
+            # Hashear el base64 tal cual evita pagar el decode sólo para
+            # calcular la clave
+            h.update(b"|")
+            contenido = b64.encode("ascii") if isinstance(b64, str) else b64
+            h.update(hashlib.sha256(contenido).digest())
+        texto = documento.get("textPlano")
+        if texto:
+            h.update(b"|")
+            h.update(str(texto).encode("utf-8"))
+    return h.hexdigest()
+
+
+def _purgar_vencidas(ahora: float) -> None:
+    vencidas = [clave for clave, (expira_en, _) in _cache.items() if expira_en <= ahora]
+    for clave in vencidas:
+        _cache.pop(clave, None)
+
+
+async def cached_llm(
+    archivos_data: List[Dict[str, Any]],
+    nombre_modelo: str = "modelo_por_defecto",
+    ttl: int = _CACHE_TTL,
+    skip_cache: bool = False,
+) -> Dict[str, Any]:
+    """Versión cacheada de procesar_con_modelo_dinamico_desde_bd.
+
+    Con skip_cache=True (por ejemplo en re-ejecuciones manuales o reintentos)
+    se fuerza la inferencia y no se guarda el resultado.
+    """
+    if skip_cache:
+        async with _llm_sem:
+            return await procesar_con_modelo_dinamico_desde_bd(archivos_data, nombre_modelo)
+
+    clave = _cache_key(archivos_data, nombre_modelo)
+    ahora = time.monotonic()
+
+    entrada = _cache.get(clave)
+    if entrada is not None and entrada[0] > ahora:
+        logger.info("[LLM_CACHE] Hit para modelo %s", nombre_modelo)
+        return entrada[1]
+
+    async with _llm_sem:
+        resultado = await procesar_con_modelo_dinamico_desde_bd(archivos_data, nombre_modelo)
+
+    # No cachear resultados con error: un reintento debe volver a inferir
+    if not isinstance(resultado.get("resultado"), dict) or "error" not in resultado["resultado"]:
+        if len(_cache) >= _CACHE_MAX_ENTRIES:
+            _purgar_vencidas(ahora)
+            if len(_cache) >= _CACHE_MAX_ENTRIES:
+                # Aún lleno: descartar la entrada más antigua (orden de inserción)
+                _cache.pop(next(iter(_cache)), None)
+        _cache[clave] = (ahora + ttl, resultado)
+
+    return resultado
+
+
+def invalidar_cache_llm() -> None:
+    """Vacía el cache completo (útil al actualizar prompts de modelos)."""
+    _cache.clear()
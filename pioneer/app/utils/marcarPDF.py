@@ -296,10 +296,67 @@ class MarcadorPDF:
                 "uri_original": gcs_uri if 'gcs_uri' in locals() else None
             }
     
+    def marcar_pdf_bytes(self, input_bytes: bytes) -> dict:
+        """
+        Marca un PDF completamente en memoria (sin pasar por disco).
+
+        Args:
+            input_bytes: Contenido del PDF de entrada
+
+        Returns:
+            dict: Resultado del procesamiento; con success=True incluye
+                  "pdf_bytes" con el PDF marcado
+        """
+        try:
+            # Generar la marca de validación
+            marca_validacion = self.generar_marca_validacion()
+
+            input_pdf = PdfReader(io.BytesIO(input_bytes))
+            output_pdf = PdfWriter()
+
+            # Procesar cada página
+            for page_num, page in enumerate(input_pdf.pages):
+                if page_num == 0:  # Solo marcar la primera página
+                    # Obtener dimensiones de la página
+                    page_box = page.mediabox
+                    page_width = float(page_box.width)
+                    page_height = float(page_box.height)
+
+                    # Crear overlay con la marca
+                    overlay_bytes = self.crear_overlay_marca(marca_validacion, page_width, page_height)
+
+                    # Leer el overlay
+                    overlay_pdf = PdfReader(io.BytesIO(overlay_bytes))
+                    overlay_page = overlay_pdf.pages[0]
+
+                    # Combinar la página original con el overlay
+                    page.merge_page(overlay_page)
+
+                # Agregar la página al PDF de salida
+                output_pdf.add_page(page)
+
+            # Serializar el PDF modificado en memoria
+            output_buffer = io.BytesIO()
+            output_pdf.write(output_buffer)
+
+            return {
+                "success": True,
+                "pdf_bytes": output_buffer.getvalue(),
+                "marca_aplicada": marca_validacion,
+                "fecha_procesamiento": datetime.now().isoformat()
+            }
+
+        except Exception as e:
+            logger.error(f"Error marcando PDF en memoria: {str(e)}")
+            return {"success": False, "error": str(e)}
+
     def marcar_pdf_local(self, input_path: str, output_path: str) -> dict:
         """
         Marca un PDF local con la validación (útil para testing).
-        
+
+        Wrapper delgado sobre marcar_pdf_bytes que conserva la interfaz por
+        rutas de archivo.
+
         Args:
             input_path: Ruta del PDF de entrada
             output_path: Ruta del PDF de salida
@@ -308,45 +365,19 @@ class MarcadorPDF:
             dict: Resultado del procesamiento
         """
         try:
-            # Generar la marca de validación
-            marca_validacion = self.generar_marca_validacion()
-            
-            # Leer el PDF de entrada
             with open(input_path, 'rb') as file:
-                input_pdf = PdfReader(file)
-                output_pdf = PdfWriter()
-                
-                # Procesar cada página
-                for page_num, page in enumerate(input_pdf.pages):
-                    if page_num == 0:  # Solo marcar la primera página
-                        # Obtener dimensiones de la página
-                        page_box = page.mediabox
-                        page_width = float(page_box.width)
-                        page_height = float(page_box.height)
-                        
-                        # Crear overlay con la marca
-                        overlay_bytes = self.crear_overlay_marca(marca_validacion, page_width, page_height)
-                        
-                        # Leer el overlay
-                        overlay_pdf = PdfReader(io.BytesIO(overlay_bytes))
-                        overlay_page = overlay_pdf.pages[0]
-                        
-                        # Combinar la página original con el overlay
-                        page.merge_page(overlay_page)
-                    
-                    # Agregar la página al PDF de salida
-                    output_pdf.add_page(page)
-                
-                # Guardar el PDF modificado
-                with open(output_path, 'wb') as output_file:
-                    output_pdf.write(output_file)
-            
+                resultado = self.marcar_pdf_bytes(file.read())
+
+            if not resultado.get("success"):
+                return resultado
+
+            with open(output_path, 'wb') as output_file:
+                output_file.write(resultado.pop("pdf_bytes"))
+
             return {
-                "success": True,
+                **resultado,
                 "input_path": input_path,
                 "output_path": output_path,
-                "marca_aplicada": marca_validacion,
-                "fecha_procesamiento": datetime.now().isoformat()
             }
             
         except Exception as e: